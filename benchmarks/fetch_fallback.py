@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of fetch_fallback against the old transfer path
+
+Serves random bodies from a local HTTP server, opens a same-origin page
+in the browser and fetches every body again with:
+
+  numbers   the old path, page fetch returning a JSON array of byte values
+  base64    page fetch encoded with btoa in the page (FETCH_BASE64_JS)
+  request   page.context.request.get, the first path of fetch_fallback
+  fallback  fetch_fallback itself
+
+Times are wall clock and include the page work (e.g. the btoa loop) and
+the transfer from browser to driver to Python. Memory is the peak traced
+Python allocation during the call; browser memory is not measured.
+Needs the Playwright browser of requirements.txt; see
+benchmarks/transfer_decode.py for the decode cost alone.
+
+Usage:
+  python3 benchmarks/fetch_fallback.py
+  python3 benchmarks/fetch_fallback.py --sizes 1MB,5MB,20MB --repeat 5
+"""
+
+import os
+import sys
+import time
+import base64
+import asyncio
+import argparse
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from playwright.async_api import async_playwright
+from src.utils import parse_size
+from src.handlers import FETCH_BASE64_JS, fetch_fallback
+from src.cloner import launch_browser
+
+FETCH_NUMBERS_JS = """async url => {
+    try {
+        const r = await fetch(url);
+        const b = await r.arrayBuffer();
+        return Array.from(new Uint8Array(b));
+    } catch(e){ return null; }
+}"""
+
+
+def start_server(bodies):
+    """Serve ``bodies`` (path → bytes) and an empty page at / on a free port"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = bodies.get(self.path, b"<!doctype html><title>bench</title>")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream" if self.path in bodies else "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def fetch_numbers(page, url):
+    data = await page.evaluate(FETCH_NUMBERS_JS, url)
+    return bytes(data) if data else None
+
+
+async def fetch_base64(page, url):
+    data = await page.evaluate(FETCH_BASE64_JS, url)
+    return base64.b64decode(data) if data else None
+
+
+async def fetch_request(page, url):
+    response = await page.context.request.get(url)
+    return await response.body()
+
+
+METHODS = {
+    "numbers": fetch_numbers,
+    "base64": fetch_base64,
+    "request": fetch_request,
+    "fallback": fetch_fallback,
+}
+
+
+async def measure(fetch, page, url, body, repeat):
+    """Best time and peak traced memory of fetching one body"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await fetch(page, url)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        assert result == body, f"{fetch.__name__} returned a different body"
+        del result
+
+    tracemalloc.start()
+    result = await fetch(page, url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, peak
+
+
+async def main(sizes, repeat):
+    bodies = {f"/{size}": os.urandom(size) for size in sizes}
+    server = start_server(bodies)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        async with async_playwright() as pw:
+            browser = await launch_browser(pw, True)
+            page = await browser.new_page()
+            await page.goto(base_url + "/")
+
+            print(f"{'size':>10} {'method':>8} {'time':>10} {'peak memory':>12}")
+            for size in sizes:
+                url = f"{base_url}/{size}"
+                for name, fetch in METHODS.items():
+                    elapsed, peak = await measure(fetch, page, url, bodies[f"/{size}"], repeat)
+                    print(f"{size:>10} {name:>8} {elapsed * 1000:>8.1f}ms {peak / (1 << 20):>10.1f}MB")
+            await browser.close()
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare fetch_fallback with the old transfer path in a browser.")
+    parser.add_argument("--sizes", default="1MB,5MB", help="Comma separated body sizes. Default: 1MB,5MB")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per method, the best is reported. Default: 3")
+    args = parser.parse_args()
+
+    asyncio.run(main([parse_size(item) for item in args.sizes.split(",")], args.repeat))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Decode-cost microbenchmark of the body formats used by fetch_fallback
+
+Only measures what the Python side does with a payload once it has
+arrived as JSON from the Playwright driver:
+
+  numbers  the old path, JSON array of byte values → list → bytes
+  base64   base64 string in JSON (page fetch and request context) → bytes
+
+It does not call fetch_fallback, Playwright or a browser. The in-page
+btoa encoding of the base64 path, which is its main cost, and the
+transfer between browser, driver and Python are not included, so the
+numbers are a lower bound and not end-to-end timings.
+
+Usage:
+  python3 benchmarks/transfer_decode.py
+  python3 benchmarks/transfer_decode.py --sizes 1MB,5MB,20MB --repeat 5
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.utils import parse_size
+
+
+def payload_numbers(body):
+    return json.dumps(list(body))
+
+
+def decode_numbers(payload):
+    return bytes(json.loads(payload))
+
+
+def payload_base64(body):
+    return json.dumps(base64.b64encode(body).decode("ascii"))
+
+
+def decode_base64(payload):
+    return base64.b64decode(json.loads(payload))
+
+
+METHODS = {
+    "numbers": (payload_numbers, decode_numbers),
+    "base64": (payload_base64, decode_base64),
+}
+
+
+def measure(decode, payload, body, repeat):
+    """Best time and peak traced memory of decoding one payload"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = decode(payload)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        assert result == body
+        del result
+
+    tracemalloc.start()
+    result = decode(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the Python-side decode cost of fetch_fallback body formats.")
+    parser.add_argument("--sizes", default="1MB,5MB", help="Comma separated body sizes. Default: 1MB,5MB")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per method, the best is reported. Default: 3")
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'method':>8} {'payload':>12} {'time':>10} {'peak memory':>12}")
+    for size in (parse_size(item) for item in args.sizes.split(",")):
+        body = os.urandom(size)
+        for name, (encode, decode) in METHODS.items():
+            payload = encode(body)
+            elapsed, peak = measure(decode, payload, body, args.repeat)
+            print(f"{size:>10} {name:>8} {len(payload):>12} {elapsed * 1000:>8.1f}ms {peak / (1 << 20):>10.1f}MB")
+            del payload
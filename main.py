@@ -9,18 +9,55 @@ Usage examples:
   python3 main.py https://example.com output_folder
   python3 main.py https://example.com output_folder --full --timeout 2m
   python3 main.py https://example.com output_folder --no-headless --crawl-internal
+  python3 main.py https://example.com output_folder --crawl-internal --concurrency 8
+  python3 main.py https://example.com output_folder --crawl-internal --max-depth 3 --max-pages 500
+  python3 main.py https://example.com output_folder --crawl-internal --incremental
+  python3 main.py urls.txt output_folder --batch --contexts 4
+  python3 main.py https://example.com output_folder --crawl-internal --max-depth 5 --workers 4
+  python3 main.py https://example.com output_folder --crawl-internal --max-depth 5 --resume
+  python3 main.py https://example.com output_folder --block-types media,font --max-response-size 5MB
+  python3 main.py https://example.com output_folder --fetch-missing --host-connections 8
+  python3 main.py https://example.com output_folder --crawl-internal --deferred-rewrite --rewrite-workers 8
+  python3 main.py https://example.com output_folder --crawl-internal --archive
+  python3 main.py https://example.com output_folder --crawl-internal --max-depth 5 --fanout
+  python3 main.py rewrite output_folder --workers 8
 """
 
+import sys
 import asyncio
 import argparse
-from src import clone_page, parse_timeout
+from src import (
+    clone_page, clone_batch, parse_timeout, parse_size, read_url_list,
+    RequestFilter, read_domain_list, parse_resource_types, rewrite_mirror
+)
+
+def run_rewrite(argv):
+    """main.py rewrite: rewrite the links of an existing mirror without a browser"""
+    parser = argparse.ArgumentParser(
+        prog="main.py rewrite",
+        description="Rewrite the links of all HTML and CSS files of an existing mirror again, using its manifest.json. No browser or network access is needed."
+    )
+    parser.add_argument("output", 
+        help="Output folder of a previous clone"
+    )
+    parser.add_argument("--workers", 
+        type=int, 
+        default=None, 
+        help="Number of processes used for rewriting. Default: one per CPU"
+    )
+    args = parser.parse_args(argv)
+    rewrite_mirror(args.output, args.workers)
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "rewrite":
+        run_rewrite(sys.argv[2:])
+        sys.exit(0)
+
     parser = argparse.ArgumentParser(
         description="Clone web pages and all their assets. This tool uses Playwright to capture web pages along with all assets (images, CSS, JavaScript, fonts, etc.) and saves them in an organized folder structure."
     )
     parser.add_argument("url", 
-        help="Target URL to clone. Example: https://example.com"
+        help="Target URL to clone. Example: https://example.com. With --batch, a file with one URL per line, or - to read them from stdin"
     )
     parser.add_argument("output", 
         help="Output folder where the cloned content will be saved. A folder structure domain/assets/{js,css,images,etc} will be created"
@@ -42,15 +79,156 @@ if __name__ == "__main__":
         action="store_true", 
         help="Crawl and download internal links found on the page. Warning: This can significantly increase processing time and result size."
     )
+    parser.add_argument("--concurrency", 
+        type=int, 
+        default=4, 
+        help="Number of browser tabs used in parallel when crawling internal links. Default: 4"
+    )
+    parser.add_argument("--host-delay", 
+        type=float, 
+        default=1.0, 
+        help="Minimum delay in seconds between two page loads on the same host while crawling. Default: 1.0"
+    )
+    parser.add_argument("--max-depth", 
+        type=int, 
+        default=1, 
+        help="How many links deep to follow when crawling internal links. 1 only visits links on the start page. Default: 1"
+    )
+    parser.add_argument("--max-pages", 
+        type=int, 
+        default=None, 
+        help="Stop crawling after this many pages (including the start page). Default: unlimited"
+    )
+    parser.add_argument("--max-bytes", 
+        type=parse_size, 
+        default=None, 
+        help="Stop crawling once this much data has been captured. Examples: 500MB, 2GB. Default: unlimited"
+    )
+    parser.add_argument("--writers", 
+        type=int, 
+        default=4, 
+        help="Number of background threads that rewrite and save captured files. Default: 4"
+    )
+    parser.add_argument("--no-cache", 
+        action="store_true", 
+        help="Do not use the capture cache in <output>/.cache. By default assets from previous runs are reused or revalidated instead of downloaded again."
+    )
+    parser.add_argument("--incremental", 
+        action="store_true", 
+        help="Re-mirror into an existing output folder, only rewriting files that changed since the previous run (uses <output>/manifest.json)."
+    )
+    parser.add_argument("--idle", 
+        type=parse_timeout, 
+        default=2000, 
+        help="Finish the capture once the network has been quiet this long, instead of always waiting for the full --timeout. Default: 2s. Examples: 500ms, 5s"
+    )
+    parser.add_argument("--batch", 
+        action="store_true", 
+        help="Clone every URL listed in the file given as url (or stdin with -) using one shared browser, writer pool and cache."
+    )
+    parser.add_argument("--contexts", 
+        type=int, 
+        default=2, 
+        help="With --batch, number of browser contexts (sites cloned at the same time). Default: 2"
+    )
+    parser.add_argument("--workers", 
+        type=int, 
+        default=1, 
+        help="With --crawl-internal, number of processes (each with its own browser) that share the crawl. Default: 1"
+    )
+    parser.add_argument("--resume", 
+        action="store_true", 
+        help="With --crawl-internal, continue an interrupted crawl from its journal in <output>/.crawl instead of starting over."
+    )
+    parser.add_argument("--block-domains", 
+        type=read_domain_list, 
+        default=[], 
+        help="Never request these domains or their subdomains. Comma separated list, or a blocklist file (one domain per line or hosts-file format)."
+    )
+    parser.add_argument("--block-types", 
+        type=parse_resource_types, 
+        default=set(), 
+        help="Skip requests of these resource types, e.g. media,font. Types: stylesheet, image, media, font, script, texttrack, xhr, fetch, eventsource, websocket, manifest, other"
+    )
+    parser.add_argument("--max-response-size", 
+        type=parse_size, 
+        default=None, 
+        help="Do not save responses whose Content-Length is above this size, and skip later requests for them. Examples: 5MB, 500KB. Default: unlimited"
+    )
+    parser.add_argument("--fetch-missing", 
+        action="store_true", 
+        help="After each page, download assets referenced by stylesheets, img/srcset, scripts and stylesheet links that the browser never requested, directly over HTTP with the page's cookies."
+    )
+    parser.add_argument("--host-connections", 
+        type=int, 
+        default=6, 
+        help="With --fetch-missing, maximum parallel downloads per host. Default: 6"
+    )
+    parser.add_argument("--deferred-rewrite", 
+        action="store_true", 
+        help="Store HTML and CSS raw during the capture and rewrite all links in one parallel pass at the end, when every asset is known. Raw bodies are kept in <output>/.raw."
+    )
+    parser.add_argument("--rewrite-workers", 
+        type=int, 
+        default=None, 
+        help="With --deferred-rewrite, number of processes for the rewrite pass. Default: one per CPU"
+    )
+    parser.add_argument("--archive", 
+        action="store_true", 
+        help="Append every captured file to a single <output>/mirror.zip instead of writing loose files. Implies --no-cache. Not combinable with --deferred-rewrite, --incremental, --fetch-missing or --workers > 1."
+    )
+    parser.add_argument("--fanout", 
+        action="store_true", 
+        help="Spread assets over nested hash folders (assets/<type>/ab/cd/<hash>.ext) so no folder gets huge on very large mirrors."
+    )
     args = parser.parse_args()
+    if args.archive and (args.deferred_rewrite or args.incremental or args.fetch_missing or args.workers > 1):
+        parser.error("--archive cannot be combined with --deferred-rewrite, --incremental, --fetch-missing or --workers > 1")
+    if (args.workers > 1 or args.resume) and (args.batch or not args.crawl_internal):
+        parser.error("--workers > 1 and --resume need --crawl-internal and cannot be combined with --batch")
 
-    asyncio.run(
-        clone_page(
-            args.url,
-            args.output,
-            args.full,
-            args.timeout,
-            not args.no_headless,
-            args.crawl_internal
-        )
+    options = dict(
+        crawl_internal=args.crawl_internal,
+        concurrency=args.concurrency,
+        host_delay=args.host_delay,
+        max_depth=args.max_depth,
+        max_pages=args.max_pages,
+        max_bytes=args.max_bytes,
+        writers=args.writers,
+        use_cache=not args.no_cache,
+        incremental=args.incremental,
+        idle_ms=args.idle,
+        request_filter=RequestFilter(args.block_domains, args.block_types, args.max_response_size),
+        fetch_missing=args.fetch_missing,
+        host_connections=args.host_connections,
+        deferred_rewrite=args.deferred_rewrite,
+        rewrite_workers=args.rewrite_workers,
+        archive=args.archive,
+        fanout=args.fanout
     )
+
+    if args.batch:
+        asyncio.run(
+            clone_batch(
+                read_url_list(args.url),
+                args.output,
+                args.full,
+                args.timeout,
+                not args.no_headless,
+                contexts=args.contexts,
+                **options
+            )
+        )
+    else:
+        asyncio.run(
+            clone_page(
+                args.url,
+                args.output,
+                args.full,
+                args.timeout,
+                not args.no_headless,
+                workers=args.workers,
+                resume=args.resume,
+                **options
+            )
+        )
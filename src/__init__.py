@@ -1,2 +1,4 @@
-from .cloner import clone_page
-from .utils import parse_timeout
+from .cloner import clone_page, clone_batch
+from .utils import parse_timeout, parse_size, read_url_list
+from .filters import RequestFilter, read_domain_list, parse_resource_types
+from .deferred import rewrite_mirror
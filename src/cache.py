@@ -0,0 +1,163 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from email.utils import parsedate_to_datetime
+
+from .utils import write_blob, copy_blob
+
+CACHE_DIR_NAME = ".cache"
+MAX_AGE_REGEX = re.compile(r"max-age=(\d+)")
+# Headers that describe the original transfer, not the body replayed from disk
+UNREPLAYED_HEADERS = {"content-length", "content-encoding", "transfer-encoding", "connection", "keep-alive",
+                      "set-cookie"}
+
+
+def freshness_deadline(headers: dict, now: float) -> float:
+    """Compute until when a response may be reused without revalidation"""
+    cache_control = (headers.get("cache-control") or "").lower()
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return 0
+    match = MAX_AGE_REGEX.search(cache_control)
+    if match:
+        return now + int(match.group(1))
+    expires = headers.get("expires")
+    if expires:
+        try:
+            return parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return 0
+    return 0
+
+
+class CaptureCache:
+    """Persistent cache of captured responses, shared between runs
+
+    An SQLite index keyed by URL stores the validators (ETag,
+    Last-Modified), the freshness deadline, the content hash and the
+    response headers to replay (e.g. Access-Control-Allow-Origin); bodies
+    live next to it as content-addressed blobs. Safe to use from the
+    writer threads and the event loop at the same time, and from several
+    processes sharing the same output folder.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, "index.sqlite"), timeout=30, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                hash TEXT NOT NULL,
+                content_type TEXT,
+                expires REAL NOT NULL DEFAULT 0,
+                stored_at REAL NOT NULL,
+                headers TEXT
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(entries)")}
+        if "headers" not in columns:  # Index created by an older version
+            self._conn.execute("ALTER TABLE entries ADD COLUMN headers TEXT")
+        self._conn.commit()
+        # URLs answered from the cache whose response event is still to come
+        self._served = set()
+
+    def blob_path(self, body_hash):
+        return os.path.join(self.blob_dir, body_hash)
+
+    def lookup(self, url):
+        """Return the cached entry for a URL, or None if missing or its blob is gone"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, hash, content_type, expires, headers FROM entries WHERE url = ?",
+                (url,)
+            ).fetchone()
+        if not row or not os.path.exists(self.blob_path(row[2])):
+            return None
+        return {
+            "etag": row[0],
+            "last_modified": row[1],
+            "hash": row[2],
+            "content_type": row[3],
+            "expires": row[4],
+            "headers": json.loads(row[5]) if row[5] else {},
+        }
+
+    def read_body(self, entry):
+        with open(self.blob_path(entry["hash"]), "rb") as f:
+            return f.read()
+
+    def mark_served(self, url):
+        """Note that a request was fulfilled from the cache"""
+        self._served.add(url)
+
+    def take_served(self, url):
+        """True once for a response that was fulfilled from the cache
+
+        Such responses only carry the replayed headers, storing them again
+        would overwrite the entry with itself at best.
+        """
+        if url in self._served:
+            self._served.discard(url)
+            return True
+        return False
+
+    def store(self, url, headers, body, body_hash, link_from=None):
+        """Remember a response; ``link_from`` is an identical file to hard-link instead of copying
+
+        ``body`` may be None for streamed responses, the blob is then
+        linked or copied from ``link_from``.
+        """
+        now = time.time()
+        if "no-store" in (headers.get("cache-control") or "").lower():
+            return
+
+        blob = self.blob_path(body_hash)
+        if body is None and not (link_from and os.path.exists(link_from)):
+            return  # Streamed into an archive, nothing on disk to keep
+        if not os.path.exists(blob):
+            try:
+                if not link_from:
+                    raise OSError
+                os.link(link_from, blob)
+            except OSError:
+                if body is None:
+                    copy_blob(link_from, blob)
+                else:
+                    write_blob(blob, body)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(url, etag, last_modified, hash, content_type, expires, stored_at, headers) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, headers.get("etag"), headers.get("last-modified"), body_hash,
+                 headers.get("content-type"), freshness_deadline(headers, now), now,
+                 json.dumps({name: value for name, value in headers.items()
+                             if name.lower() not in UNREPLAYED_HEADERS}))
+            )
+            self._conn.commit()
+
+    def refresh(self, url, headers):
+        """Extend the freshness of an entry after a 304 Not Modified"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET expires = ?, stored_at = ?, "
+                "etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                (freshness_deadline(headers, now), now, headers.get("etag"), headers.get("last-modified"), url)
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
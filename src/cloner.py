@@ -1,16 +1,28 @@
 import os
 import time
+import shutil
 import asyncio
 import sqlite3
+import multiprocessing
 from urllib.parse import urlparse
 from playwright.async_api import async_playwright
 
-from .utils import mkdir, extract_and_replace_data_uri
-from .handlers import create_response_handler, handle_request
-from .crawler import auto_scroll_lazy, crawl_additional_links
-from .rewriter import rewrite_html_links
+from .utils import mkdir, save_manifest, load_manifest
+from .registry import UrlRegistry
+from .handlers import create_response_handler, create_request_handler, save_html, recheck_unchanged
+from .cache import CaptureCache, CACHE_DIR_NAME
+from .crawler import auto_scroll_lazy, crawl_additional_links, run_crawl_workers, NetworkActivity
+from .frontier import CrawlFrontier, SharedFrontier
+from .writer import ResponseWriter
+from .fetcher import DirectFetcher, relink_documents
+from .deferred import RawStore, rewrite_deferred, SNAPSHOT
+from .storage import LOCAL_FILES, ZipSink
 import json
 
+CRAWL_DIR_NAME = ".crawl"
+# Registry entries kept in memory before the rest is spilled to disk
+REGISTRY_MEMORY_LIMIT = 500000
+
 def get_users(output_dir):
     """Mengambil semua pengguna dari database"""
     db_path = os.path.join(output_dir, "admin", "users.db")
@@ -61,70 +73,15 @@ def create_user_database(output_dir):
     conn.close()
     return db_path
 
-async def clone_page(url: str, output_dir: str, full_load: bool, total_timeout_ms: int, headless: bool, crawl_internal=False):
-    mkdir(output_dir)
-    start_time = time.time()
-    end_time = start_time + (total_timeout_ms / 1000)
-
-    async with async_playwright() as pw:
-        try:
-            browser = await pw.chromium.launch(headless=headless, channel="chrome", args=["--no-sandbox"])
-        except Exception:
-            print("⚠️ Chrome not found, using Chromium instead")
-            browser = await pw.chromium.launch(headless=headless, args=["--no-sandbox"])
-        
-        page = await browser.new_page()
-
-        handle_response = await create_response_handler(page, output_dir)
-        page.on("response", handle_response)
-
-        print(f"⏱ Total capture time: {total_timeout_ms} ms ({total_timeout_ms/1000:.0f} seconds)")
-        print(f"🌐 Opening {url}...")
-
-        wait_mode = "networkidle" if full_load else "domcontentloaded"
-        await page.route("**/*", handle_request)
-        await page.goto(url, wait_until=wait_mode, timeout=0)
-        await auto_scroll_lazy(page)
-        
-        if crawl_internal:
-            print("🔍 Searching and downloading additional links...")
-            await crawl_additional_links(page, url, output_dir)
-        else:
-            print("🚫 Internal link crawling disabled")
-
-        remaining_time = end_time - time.time()
-        if remaining_time > 0:
-            print(f"⏱ Waiting {int(remaining_time)} seconds to capture additional resources...")
-            while time.time() < end_time:
-                await asyncio.sleep(1)
-
-        parsed_url = urlparse(url)
-        domain_dir = os.path.join(output_dir, parsed_url.netloc)
-        html_path = os.path.join(domain_dir, "index.html")
-        os.makedirs(domain_dir, exist_ok=True)
-
-        html_content = await page.content()
-        embedded_dir = os.path.join(domain_dir, "assets", "html", "embedded")
-        html_content = extract_and_replace_data_uri(
-            html_content,
-            embedded_dir,
-            "html_embedded"  
-        )
-        
-        
-        html_content = rewrite_html_links(html_content, url, domain_dir)
-
-        with open(html_path, "w", encoding="utf-8") as f:
-            f.write(html_content)
-        print(f"📄 HTML saved: {html_path}")
-        
-        admin_dir = os.path.join(domain_dir, "admin")
-        os.makedirs(admin_dir, exist_ok=True)
-        
-        db_path = create_user_database(output_dir)
-        
-        # Membuat API sederhana untuk mengelola pengguna
-        api_script = '''#!/usr/bin/env python3
+def write_site_files(output_dir, domain_dir):
+    """Write the admin panel, API server, README and run script next to a cloned site"""
+    admin_dir = os.path.join(domain_dir, "admin")
+    os.makedirs(admin_dir, exist_ok=True)
+    
+    db_path = create_user_database(output_dir)
+    
+    # Membuat API sederhana untuk mengelola pengguna
+    api_script = '''#!/usr/bin/env python3
 import json
 import sqlite3
 import os
@@ -244,14 +201,14 @@ if __name__ == "__main__":
         print("\\nShutting down API server...")
         server.shutdown()
 '''
-        
-        api_path = os.path.join(admin_dir, "api.py")
-        with open(api_path, "w", encoding="utf-8") as f:
-            f.write(api_script)
-        print(f"📄 API script saved: {api_path}")
-        
-        # Membuat halaman admin dengan akses ke database
-        admin_html = """<!DOCTYPE html>
+    
+    api_path = os.path.join(admin_dir, "api.py")
+    with open(api_path, "w", encoding="utf-8") as f:
+        f.write(api_script)
+    print(f"📄 API script saved: {api_path}")
+    
+    # Membuat halaman admin dengan akses ke database
+    admin_html = """<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
@@ -535,21 +492,21 @@ if __name__ == "__main__":
     </div>
 </body>
 </html>"""
+    
+    admin_path = os.path.join(admin_dir, "index.html")
+    with open(admin_path, "w", encoding="utf-8") as f:
+        f.write(admin_html)
+    print(f"📄 Admin panel saved: {admin_path}")
+    
+    # Membuat API endpoint dalam bentuk file JSON untuk menyimpan data pengguna (fallback)
+    users_data_path = os.path.join(admin_dir, "users.json")
+    users = get_users(output_dir)
+    users_data = [{"id": u[0], "username": u[1], "password": u[2], "notes": u[3]} for u in users]
+    with open(users_data_path, "w") as f:
+        json.dump(users_data, f)
         
-        admin_path = os.path.join(admin_dir, "index.html")
-        with open(admin_path, "w", encoding="utf-8") as f:
-            f.write(admin_html)
-        print(f"📄 Admin panel saved: {admin_path}")
-        
-        # Membuat API endpoint dalam bentuk file JSON untuk menyimpan data pengguna (fallback)
-        users_data_path = os.path.join(admin_dir, "users.json")
-        users = get_users(output_dir)
-        users_data = [{"id": u[0], "username": u[1], "password": u[2], "notes": u[3]} for u in users]
-        with open(users_data_path, "w") as f:
-            json.dump(users_data, f)
-            
-        # Membuat file JavaScript untuk menangani operasi CRUD langsung dari browser
-        js_api_content = '''// File API untuk menangani operasi CRUD terhadap users.json
+    # Membuat file JavaScript untuk menangani operasi CRUD langsung dari browser
+    js_api_content = '''// File API untuk menangani operasi CRUD terhadap users.json
 // Fungsi untuk membaca data pengguna
 async function getUsers() {
     try {
@@ -600,35 +557,35 @@ window.UserAPI = {
     addUser,
     deleteUser
 };'''
-        
-        js_api_path = os.path.join(admin_dir, "api.js")
-        with open(js_api_path, "w", encoding="utf-8") as f:
-            f.write(js_api_content)
-        print(f"📄 API JS saved: {js_api_path}")
-        
-        # Membuat file package.json untuk memungkinkan npm start
-        package_json_content = {
-            "name": "cloned-website",
-            "version": "1.0.0",
-            "description": "Cloned website with admin panel",
-            "scripts": {
-                "start": "concurrently \"python api.py 8001\" \"python -m http.server 8000\"",
-                "frontend": "python -m http.server 8000",
-                "backend": "python api.py 8001"
-            },
-            "dependencies": {},
-            "devDependencies": {
-                "concurrently": "^7.0.0"
-            }
+    
+    js_api_path = os.path.join(admin_dir, "api.js")
+    with open(js_api_path, "w", encoding="utf-8") as f:
+        f.write(js_api_content)
+    print(f"📄 API JS saved: {js_api_path}")
+    
+    # Membuat file package.json untuk memungkinkan npm start
+    package_json_content = {
+        "name": "cloned-website",
+        "version": "1.0.0",
+        "description": "Cloned website with admin panel",
+        "scripts": {
+            "start": "concurrently \"python api.py 8001\" \"python server.py 8000\"",
+            "frontend": "python server.py 8000",
+            "backend": "python api.py 8001"
+        },
+        "dependencies": {},
+        "devDependencies": {
+            "concurrently": "^7.0.0"
         }
-        
-        package_json_path = os.path.join(domain_dir, "package.json")
-        with open(package_json_path, "w") as f:
-            json.dump(package_json_content, f, indent=2)
-        print(f"📄 package.json saved: {package_json_path}")
-        
-        # Membuat file README dengan instruksi penggunaan
-        readme_content = f"""# Cloned Website
+    }
+    
+    package_json_path = os.path.join(domain_dir, "package.json")
+    with open(package_json_path, "w") as f:
+        json.dump(package_json_content, f, indent=2)
+    print(f"📄 package.json saved: {package_json_path}")
+    
+    # Membuat file README dengan instruksi penggunaan
+    readme_content = f"""# Cloned Website
 
 Website ini telah dikloning menggunakan python3-clonner.
 
@@ -654,9 +611,13 @@ Admin panel dapat diakses di: http://localhost:8000/admin/
 
 Untuk menjalankan hanya web server (tanpa API):
 ```bash
-python -m http.server 8000
+python server.py 8000
 ```
 
+`server.py` adalah server statis asinkron (keep-alive, sendfile, Range,
+ETag/304, file `.br`/`.gz` yang sudah dikompresi, dan MIME type dari
+manifest.json) yang hanya memakai library standar Python.
+
 Akses situs di: http://localhost:8000
 
 Untuk menjalankan API server (untuk CRUD functionality):
@@ -672,13 +633,19 @@ python api.py
 - `/assets/` - CSS, JS, gambar, dan aset lainnya
 """
 
-        readme_path = os.path.join(domain_dir, "README.md")
-        with open(readme_path, "w", encoding="utf-8") as f:
-            f.write(readme_content)
-        print(f"📄 README.md saved: {readme_path}")
-        
-        # Membuat bash script untuk menjalankan web yang sudah di-clone
-        bash_script_content = '''#!/bin/bash
+    readme_path = os.path.join(domain_dir, "README.md")
+    with open(readme_path, "w", encoding="utf-8") as f:
+        f.write(readme_content)
+    print(f"📄 README.md saved: {readme_path}")
+    
+    # Menyalin server statis ke folder situs
+    server_path = os.path.join(domain_dir, "server.py")
+    shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"), server_path)
+    os.chmod(server_path, 0o755)
+    print(f"📄 Static server saved: {server_path}")
+    
+    # Membuat bash script untuk menjalankan web yang sudah di-clone
+    bash_script_content = '''#!/bin/bash
 
 # Script untuk menjalankan website yang sudah di-clone
 # Memeriksa apakah Node.js terinstall
@@ -713,20 +680,447 @@ else
     # Menangani interrupt signal untuk menghentikan proses background
     trap "kill $API_PID 2> /dev/null; exit" INT TERM
     
-    python -m http.server 8000
+    python server.py 8000
     
     # Menghentikan API server ketika web server dihentikan
     kill $API_PID 2> /dev/null
 fi
 '''
 
-        bash_script_path = os.path.join(domain_dir, "run.sh")
-        with open(bash_script_path, "w", encoding="utf-8") as f:
-            f.write(bash_script_content)
-        
-        # Membuat file executable
-        os.chmod(bash_script_path, 0o755)
-        print(f"📄 Bash script saved: {bash_script_path}")
+    bash_script_path = os.path.join(domain_dir, "run.sh")
+    with open(bash_script_path, "w", encoding="utf-8") as f:
+        f.write(bash_script_content)
+    
+    # Membuat file executable
+    os.chmod(bash_script_path, 0o755)
+    print(f"📄 Bash script saved: {bash_script_path}")
+
+
+async def launch_browser(pw, headless):
+    """Launch Chrome, or the bundled Chromium when Chrome is not installed"""
+    try:
+        return await pw.chromium.launch(headless=headless, channel="chrome", args=["--no-sandbox"])
+    except Exception:
+        print("⚠️ Chrome not found, using Chromium instead")
+        return await pw.chromium.launch(headless=headless, args=["--no-sandbox"])
+
+async def capture_site(context, network, url: str, output_dir: str, full_load: bool, total_timeout_ms: int,
+                       crawl_internal=False, concurrency=4, host_delay=1.0, max_depth=1, max_pages=None,
+                       max_bytes=None, writer=None, cache=None, previous=None, idle_ms=2000, frontier=None,
+                       journal=None, registry=None, request_filter=None, raw_store=None, sink=LOCAL_FILES,
+                       fanout=False):
+    """Capture one URL, and optionally its internal links, in an existing browser context
 
+    Returns the domain folder the site was saved in. With a ``raw_store``,
+    HTML and CSS are kept raw for a rewrite pass after the capture. The
+    raw page snapshot is kept in .raw in any case, unless writing to an
+    archive. Files are written to ``sink``, in hash folders with ``fanout``.
+    Without a ``writer`` everything is saved inline.
+    """
+    start_time = time.time()
+    end_time = start_time + (total_timeout_ms / 1000)
+
+    page = await context.new_page()
+    if frontier is None:
+        frontier = CrawlFrontier(max_depth, max_pages, max_bytes)
+    handle_request = create_request_handler(cache, request_filter)
+
+    async def setup_page(target_page):
+        handle_response = await create_response_handler(
+            target_page, output_dir, registry,
+            on_saved=lambda _url, size: frontier.record_bytes(size),
+            writer=writer,
+            cache=cache,
+            previous=previous,
+            journal=journal,
+            request_filter=request_filter,
+            raw_store=raw_store,
+            sink=sink,
+            fanout=fanout
+        )
+        target_page.on("response", handle_response)
+        await target_page.route("**/*", handle_request)
+
+    await setup_page(page)
+
+    print(f"⏱ Total capture time: {total_timeout_ms} ms ({total_timeout_ms/1000:.0f} seconds)")
+    print(f"🌐 Opening {url}...")
+
+    wait_mode = "networkidle" if full_load else "domcontentloaded"
+    await page.goto(url, wait_until=wait_mode, timeout=0)
+    # Scrolling gets at most a quarter of the capture time
+    await auto_scroll_lazy(page, network=network, total_timeout=min(30.0, max(1.0, (end_time - time.time()) / 4)))
+    
+    if crawl_internal:
+        print("🔍 Searching and downloading additional links...")
+        await crawl_additional_links(
+            page, url, output_dir,
+            setup_page=setup_page,
+            concurrency=concurrency,
+            host_delay=host_delay,
+            frontier=frontier,
+            registry=registry
+        )
+    else:
+        print("🚫 Internal link crawling disabled")
+
+    remaining_time = end_time - time.time()
+    if remaining_time > 0:
+        print(f"⏱ Waiting up to {int(remaining_time)} seconds for the network to go quiet...")
+        if await network.wait_for_quiet(idle_ms / 1000, remaining_time):
+            print(f"🔕 No network activity for {idle_ms / 1000:.1f} seconds, finishing capture")
+
+    parsed_url = urlparse(url)
+    domain_dir = os.path.join(output_dir, parsed_url.netloc)
+    html_path = os.path.join(domain_dir, "index.html")
+    os.makedirs(domain_dir, exist_ok=True)
+
+    html_content = await page.content()
+    embedded_dir = os.path.join(domain_dir, "assets", "html", "embedded")
+
+    def save_snapshot():
+        if raw_store is not None:
+            raw_store.add(url, "text/html", html_content.encode("utf-8"), html_path, SNAPSHOT)
+            return
+        save_html(html_content, url, html_path, embedded_dir, "html_embedded", registry, sink)
+        print(f"📄 HTML saved: {html_path}")
+        if sink is LOCAL_FILES:
+            # The snapshot is in no manifest or cache, keep it for main.py rewrite
+            RawStore(output_dir).add(url, "text/html", html_content.encode("utf-8"), html_path, SNAPSHOT)
+
+    if writer:
+        await writer.submit(save_snapshot)
+    else:
+        save_snapshot()
+    await page.close()
+    return domain_dir
+
+async def clone_batch(urls, output_dir: str, full_load: bool, total_timeout_ms: int, headless: bool, crawl_internal=False,
+                      concurrency=4, host_delay=1.0, max_depth=1, max_pages=None, max_bytes=None, writers=4,
+                      use_cache=True, incremental=False, idle_ms=2000, contexts=2, frontier=None, journal=None,
+                      registry=None, request_filter=None, fetch_missing=False, host_connections=6,
+                      deferred_rewrite=False, rewrite_workers=None, raw_store=None, archive=False, fanout=False):
+    """Clone several URLs with one browser, a pool of contexts and a shared writer and cache
+
+    Up to ``contexts`` sites are captured at the same time, each in its own
+    browser context; cookies are cleared before a context is reused.
+    A ``frontier`` and crawl ``journal`` can only be given for a single URL.
+    Without a ``registry`` a private one is used for this batch, spilling
+    to <output>/.crawl when it grows too large. With ``fetch_missing``,
+    assets referenced by stylesheets that the page never requested are
+    downloaded directly afterwards, ``host_connections`` at a time per host,
+    and HTML and CSS are relinked to them once every site is done.
+
+    With ``deferred_rewrite``, HTML and CSS are stored raw during the
+    capture and rewritten in one pass of ``rewrite_workers`` processes once
+    every site is captured, so links see the final URL map. A caller that
+    passes its own ``raw_store`` runs that pass itself.
+
+    With ``archive``, captured files are appended to <output>/mirror.zip
+    instead of being written as loose files, and the capture cache is off.
+    With ``fanout``, assets are
+    spread over nested hash folders (assets/<type>/ab/cd/<hash>.ext).
+    """
+    mkdir(output_dir)
+    own_registry = registry is None
+    if own_registry:
+        registry = UrlRegistry(
+            os.path.join(output_dir, CRAWL_DIR_NAME, f"registry-{os.getpid()}.sqlite"),
+            memory_limit=REGISTRY_MEMORY_LIMIT
+        )
+    own_raw_store = deferred_rewrite and raw_store is None
+    if own_raw_store:
+        raw_store = RawStore(output_dir)
+    sink = ZipSink(output_dir) if archive else LOCAL_FILES
+    writer = ResponseWriter(writers).start()
+    # Cache blobs are loose files, an archive would not save a single inode with them
+    cache = CaptureCache(os.path.join(output_dir, CACHE_DIR_NAME)) if use_cache and not archive else None
+    previous = load_manifest(output_dir) if incremental else None
+    if previous is not None:
+        print(f"🔁 Incremental mode: {len(previous)} files known from the previous run")
+
+    async with async_playwright() as pw:
+        browser = await launch_browser(pw, headless)
+
+        pages = []  # Snapshots of this batch, relinked with the rest
+        fetched = 0
+        pool = asyncio.Queue()
+        for _ in range(max(1, min(contexts, len(urls)))):
+            context = await browser.new_context()
+            pool.put_nowait((context, NetworkActivity().attach(context)))
+
+        async def clone_one(target_url):
+            nonlocal fetched
+            context, network = await pool.get()
+            try:
+                domain_dir = await capture_site(
+                    context, network, target_url, output_dir, full_load, total_timeout_ms,
+                    crawl_internal, concurrency, host_delay, max_depth, max_pages, max_bytes,
+                    writer, cache, previous, idle_ms, frontier, journal, registry, request_filter, raw_store, sink,
+                    fanout
+                )
+                pages.append((target_url, os.path.join(domain_dir, "index.html")))
+                if fetch_missing and raw_store is None:
+                    await writer.drain()
+                    fetcher = DirectFetcher(
+                        context.request, output_dir, urlparse(target_url).netloc, registry, writer, cache,
+                        request_filter, host_connections, fanout=fanout
+                    )
+                    fetched += await fetcher.fetch_missing()
+                write_site_files(output_dir, domain_dir)
+            except Exception as e:
+                if len(urls) == 1:
+                    raise
+                print(f"❌ Failed to clone {target_url}: {e}")
+            finally:
+                await context.clear_cookies()
+                pool.put_nowait((context, network))
+
+        try:
+            try:
+                await asyncio.gather(*(clone_one(target_url) for target_url in urls))
+                if own_raw_store:
+                    await writer.drain()
+                    await asyncio.to_thread(rewrite_deferred, output_dir, registry, rewrite_workers, raw_store.jobs())
+                    if fetch_missing:
+                        context, _ = await pool.get()
+                        fetcher = DirectFetcher(
+                            context.request, output_dir, None, registry, writer, cache, request_filter,
+                            host_connections, fanout=fanout
+                        )
+                        fetched += await fetcher.fetch_missing()
+                if previous is not None:
+                    await writer.drain()
+                    await asyncio.to_thread(recheck_unchanged, registry, cache)
+                if fetched:
+                    # Only now no context or writer touches the files any more
+                    await writer.drain()
+                    await asyncio.to_thread(relink_documents, registry, pages)
+            finally:
+                await writer.close()
+                if cache:
+                    cache.close()
+
+            manifest_path = save_manifest(output_dir, registry, previous)
+            print(f"📄 Manifest saved: {manifest_path}")
+            if archive:
+                with open(manifest_path, "rb") as f, sink.open(manifest_path) as out:
+                    out.write(f.read())
+        finally:
+            # Also on failure, the ZIP is unreadable without its central directory
+            sink.close()
+            if archive:
+                print(f"🗜 Archive saved: {sink.archive_path}")
+        not_captured = registry.not_captured()
+        if own_registry:
+            registry.close(remove=True)
+        if not_captured:
+            print(f"🔎 {len(not_captured)} assets referenced in HTML/CSS were not captured")
+        
         print("\n✅ Resource & HTML capture completed!")
-        await browser.close()
\ No newline at end of file
+        await browser.close()
+
+def restore_from_journal(journal, output_dir, registry):
+    """Register the files saved by an earlier or parallel run"""
+    restored = 0
+    for saved_url, path, entry in journal.load_saved():
+        if saved_url in registry:
+            continue
+        entry["links"] = {
+            link: os.path.join(output_dir, link_path) for link, link_path in entry.get("links", {}).items()
+        }
+        registry.register(saved_url, os.path.join(output_dir, path), entry)
+        restored += 1
+    return restored
+
+def remove_database(path):
+    """Delete an SQLite file together with its WAL files"""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def open_crawl_registry(output_dir, workers):
+    """Registry of a journaled crawl, shared on disk when several processes take part"""
+    if workers > 1:
+        return UrlRegistry(os.path.join(output_dir, CRAWL_DIR_NAME, "registry.sqlite"), memory_limit=0)
+    return UrlRegistry(
+        os.path.join(output_dir, CRAWL_DIR_NAME, f"registry-{os.getpid()}.sqlite"),
+        memory_limit=REGISTRY_MEMORY_LIMIT
+    )
+
+async def crawl_shard(shard, workers, url, output_dir, frontier_path, headless, concurrency=4, host_delay=1.0,
+                      max_depth=1, max_pages=None, max_bytes=None, writers=4, use_cache=True, incremental=False,
+                      request_filter=None, deferred_rewrite=False, raw_run=None, fanout=False):
+    """Crawl one shard of a site in its own browser (runs in a worker process)
+
+    With ``deferred_rewrite``, raw bodies are tagged with the ``raw_run``
+    of the main process, which rewrites them once every shard is done.
+    """
+    frontier = SharedFrontier(frontier_path, shard, workers, max_depth, max_pages, max_bytes)
+    registry = open_crawl_registry(output_dir, workers)
+    raw_store = RawStore(output_dir, raw_run) if deferred_rewrite else None
+    writer = ResponseWriter(writers).start()
+    cache = CaptureCache(os.path.join(output_dir, CACHE_DIR_NAME)) if use_cache else None
+    previous = load_manifest(output_dir) if incremental else None
+    handle_request = create_request_handler(cache, request_filter)
+
+    async def setup_page(target_page):
+        handle_response = await create_response_handler(
+            target_page, output_dir, registry,
+            on_saved=lambda _url, size: frontier.record_bytes(size),
+            writer=writer,
+            cache=cache,
+            previous=previous,
+            journal=frontier,
+            request_filter=request_filter,
+            raw_store=raw_store,
+            fanout=fanout
+        )
+        target_page.on("response", handle_response)
+        await target_page.route("**/*", handle_request)
+
+    try:
+        async with async_playwright() as pw:
+            browser = await launch_browser(pw, headless)
+            context = await browser.new_context()
+            await run_crawl_workers(
+                context, frontier, url,
+                setup_page=setup_page,
+                concurrency=concurrency,
+                host_delay=host_delay,
+                registry=registry
+            )
+            await browser.close()
+    finally:
+        await writer.close()
+        if previous is not None:
+            recheck_unchanged(registry, cache)
+        if cache:
+            cache.close()
+        frontier.close()
+        registry.close()
+
+def run_shard_worker(shard, workers, url, output_dir, frontier_path, headless, options):
+    """Entry point of a worker process"""
+    print(f"🧩 Worker {shard}/{workers} started (pid {os.getpid()})")
+    asyncio.run(crawl_shard(shard, workers, url, output_dir, frontier_path, headless, **options))
+
+async def clone_sharded(url: str, output_dir: str, full_load: bool, total_timeout_ms: int, headless: bool,
+                        concurrency=4, host_delay=1.0, max_depth=1, max_pages=None, max_bytes=None, writers=4,
+                        use_cache=True, incremental=False, idle_ms=2000, workers=1, resume=False,
+                        request_filter=None, fetch_missing=False, host_connections=6, deferred_rewrite=False,
+                        rewrite_workers=None, archive=False, fanout=False):
+    """Crawl a site with a journaled frontier, optionally over several processes
+
+    The frontier lives in an SQLite journal in <output>/.crawl that also
+    records every saved file. With ``resume`` the journal of an interrupted
+    run is reused: visited URLs are skipped, pages that were being loaded
+    are retried and saved files are linked again. Otherwise a new journal
+    is started.
+
+    With ``workers`` > 1, URLs are sharded by hash over that many processes,
+    each with its own browser, sharing dedup and budgets through the
+    journal. This process captures the start page and shard 0; the others
+    start as soon as it is seeded. A deferred rewrite pass and the direct
+    fetch of missing assets then run here once every worker has finished.
+    """
+    mkdir(output_dir)
+    frontier_path = os.path.join(output_dir, CRAWL_DIR_NAME, "frontier.sqlite")
+    if not resume:
+        remove_database(frontier_path)
+    # The registry is rebuilt from the journal, a stale one is never reused
+    remove_database(os.path.join(output_dir, CRAWL_DIR_NAME, "registry.sqlite"))
+
+    frontier = SharedFrontier(frontier_path, 0, workers, max_depth, max_pages, max_bytes)
+    registry = open_crawl_registry(output_dir, workers)
+    if resume:
+        retried = frontier.reset_active()
+        counts = frontier.counts()
+        restored = restore_from_journal(frontier, output_dir, registry)
+        print(f"♻️ Resuming crawl: {counts.get('done', 0)} pages done, "
+              f"{counts.get('pending', 0)} pending ({retried} interrupted), {restored} files already saved")
+    frontier.seed(url)
+    # With other processes the rewrite pass has to wait for them
+    raw_store = RawStore(output_dir) if deferred_rewrite and workers > 1 else None
+
+    options = dict(
+        concurrency=concurrency, host_delay=host_delay, max_depth=max_depth, max_pages=max_pages,
+        max_bytes=max_bytes, writers=writers, use_cache=use_cache, incremental=incremental,
+        request_filter=request_filter, deferred_rewrite=deferred_rewrite,
+        raw_run=raw_store.run_id if raw_store else None, fanout=fanout
+    )
+    mp_context = multiprocessing.get_context("spawn")
+    processes = [
+        mp_context.Process(
+            target=run_shard_worker,
+            args=(shard, workers, url, output_dir, frontier_path, headless, options)
+        )
+        for shard in range(1, workers)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        await clone_batch(
+            [url], output_dir, full_load, total_timeout_ms, headless, True,
+            concurrency, host_delay, max_depth, max_pages, max_bytes, writers,
+            use_cache, incremental, idle_ms, contexts=1, frontier=frontier, journal=frontier,
+            registry=registry, request_filter=request_filter, fetch_missing=fetch_missing and not processes,
+            host_connections=host_connections, deferred_rewrite=deferred_rewrite,
+            rewrite_workers=rewrite_workers, raw_store=raw_store, archive=archive, fanout=fanout
+        )
+    finally:
+        # Release the other processes even if the start page failed
+        frontier.mark_visited(url)
+        for process in processes:
+            await asyncio.to_thread(process.join, 60)
+            if process.is_alive():
+                print(f"⚠️ Worker pid {process.pid} did not finish, terminating")
+                process.terminate()
+
+    if processes:
+        restore_from_journal(frontier, output_dir, registry)
+        if raw_store:
+            await asyncio.to_thread(rewrite_deferred, output_dir, registry, rewrite_workers, raw_store.jobs())
+        if fetch_missing:
+            # Fetched and relinked only now, worker processes no longer write files
+            async with async_playwright() as pw:
+                request = await pw.request.new_context()
+                fetcher = DirectFetcher(
+                    request, output_dir, urlparse(url).netloc, registry, None, None, request_filter,
+                    host_connections, fanout=fanout
+                )
+                if await fetcher.fetch_missing():
+                    pages = [(url, os.path.join(output_dir, urlparse(url).netloc, "index.html"))]
+                    await asyncio.to_thread(relink_documents, registry, pages)
+                await request.dispose()
+        print(f"📄 Manifest merged from {workers} workers: {save_manifest(output_dir, registry, load_manifest(output_dir))}")
+    frontier.close()
+    registry.close(remove=True)
+
+async def clone_page(url: str, output_dir: str, full_load: bool, total_timeout_ms: int, headless: bool, crawl_internal=False,
+                     concurrency=4, host_delay=1.0, max_depth=1, max_pages=None, max_bytes=None, writers=4,
+                     use_cache=True, incremental=False, idle_ms=2000, workers=1, resume=False,
+                     request_filter=None, fetch_missing=False, host_connections=6, deferred_rewrite=False,
+                     rewrite_workers=None, archive=False, fanout=False):
+    """Clone a single URL
+
+    Crawls of internal links are journaled (and can be resumed) and run
+    over ``workers`` processes when more than one.
+    """
+    if crawl_internal:
+        await clone_sharded(
+            url, output_dir, full_load, total_timeout_ms, headless,
+            concurrency, host_delay, max_depth, max_pages, max_bytes, writers,
+            use_cache, incremental, idle_ms, workers, resume, request_filter, fetch_missing, host_connections,
+            deferred_rewrite, rewrite_workers, archive, fanout
+        )
+        return
+
+    await clone_batch(
+        [url], output_dir, full_load, total_timeout_ms, headless, crawl_internal,
+        concurrency, host_delay, max_depth, max_pages, max_bytes, writers,
+        use_cache, incremental, idle_ms, contexts=1, request_filter=request_filter,
+        fetch_missing=fetch_missing, host_connections=host_connections, deferred_rewrite=deferred_rewrite,
+        rewrite_workers=rewrite_workers, archive=archive, fanout=fanout
+    )
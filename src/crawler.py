@@ -1,6 +1,55 @@
+import time
 import asyncio
 from urllib.parse import urlparse
-from .utils import url_to_local_path
+from .frontier import CrawlFrontier
+
+class NetworkActivity:
+    """Track in-flight requests of a browser context to detect when it goes quiet
+
+    Requests that stay open longer than ``stale_after`` seconds (long
+    polling, streaming, beacons) are not counted, otherwise such pages
+    would never be considered idle.
+    """
+
+    def __init__(self, stale_after=10.0):
+        self.stale_after = stale_after
+        self.in_flight = {}
+        self.last_activity = time.monotonic()
+
+    def attach(self, context):
+        context.on("request", self._on_request)
+        context.on("requestfinished", self._on_done)
+        context.on("requestfailed", self._on_done)
+        return self
+
+    def _on_request(self, request):
+        now = time.monotonic()
+        self.in_flight[request] = now
+        self.last_activity = now
+
+    def _on_done(self, request):
+        self.in_flight.pop(request, None)
+        self.last_activity = time.monotonic()
+
+    def busy(self):
+        now = time.monotonic()
+        return any(now - started < self.stale_after for started in self.in_flight.values())
+
+    def quiet_for(self):
+        """Seconds since the last network event, 0 while requests are running"""
+        if self.busy():
+            return 0
+        return time.monotonic() - self.last_activity
+
+    async def wait_for_quiet(self, quiet_window, timeout, poll=0.1):
+        """Wait until nothing happened for ``quiet_window`` seconds, return False on timeout"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.quiet_for() >= quiet_window:
+                return True
+            await asyncio.sleep(poll)
+        return False
+
 
 async def auto_scroll(page):
     """Auto scroll to load all content on the page"""
@@ -20,69 +69,233 @@ async def auto_scroll(page):
         });
     }""")
 
-async def auto_scroll_lazy(page, delay=0.5, max_scrolls=50):
-    """Auto scroll with delay to capture lazy-loaded content"""
+SCROLL_STEP_JS = """() => {
+    window.scrollBy(0, window.innerHeight);
+    let clicked = 0;
+    document.querySelectorAll('button, a').forEach(el => {
+        if (el.offsetParent === null) return;
+        const text = (el.innerText || '').toLowerCase();
+        if (text.includes('load more') || text.includes('show more') || text.includes('view more')) {
+            el.click();
+            clicked++;
+        }
+    });
+    const height = document.documentElement.scrollHeight;
+    return {
+        height: height,
+        bottom: window.scrollY + window.innerHeight >= height - 2,
+        clicked: clicked
+    };
+}"""
+
+
+async def auto_scroll_lazy(page, delay=0.5, max_scrolls=50, network=None, stable_rounds=2, step_timeout=2.0,
+                           total_timeout=30.0):
+    """Auto scroll with delay to capture lazy-loaded content
+
+    Each step scrolls one screen and clicks "load more" style controls in a
+    single in-page call. With a ``NetworkActivity`` tracker the step waits
+    until the network has been quiet for ``delay`` seconds (at most
+    ``step_timeout``), otherwise it sleeps ``delay``. Scrolling stops once
+    the bottom is reached and the page height stayed the same for
+    ``stable_rounds`` steps, or after ``total_timeout`` seconds in all, so
+    pages that never stop polling cannot hold the capture up.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + total_timeout
+    last_height = None
+    stable = 0
+
     for i in range(max_scrolls):
-        await page.evaluate("window.scrollBy(0, window.innerHeight);")
-        await asyncio.sleep(delay)
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            print(f"📜 Scrolling stopped after {total_timeout:.0f} seconds ({i} steps)")
+            return
+        try:
+            state = await page.evaluate(SCROLL_STEP_JS)
+        except Exception:
+            # A clicked control may have navigated; let the new page load
+            state = None
 
-        buttons = await page.query_selector_all("button, a")
-        for btn in buttons:
-            try:
-                text = (await btn.inner_text()).lower()
-                if "load more" in text or "show more" in text or "view more" in text:
-                    await btn.click()
-                    await asyncio.sleep(0.5)
-            except Exception:
+        if network:
+            await network.wait_for_quiet(delay, min(step_timeout, remaining))
+        else:
+            await asyncio.sleep(min(delay, remaining))
+
+        if state is None:
+            stable = 0
+            continue
+
+        if state["bottom"] and state["height"] == last_height:
+            stable += 1
+            if stable >= stable_rounds:
+                print(f"📜 Page fully scrolled after {i + 1} steps")
+                return
+        else:
+            stable = 0
+        last_height = state["height"]
+
+LINK_COLLECTOR_JS = """() => {
+    const results = [];
+    // Collect links from a tags
+    document.querySelectorAll('a[href]').forEach(a => {
+        results.push({type: 'a', url: a.href});
+    });
+    // Collect links from other tags that might have URLs
+    const srcElements = document.querySelectorAll('img[src], script[src], link[href], iframe[src], source[src]');
+    srcElements.forEach(el => {
+        const attr = el.hasAttribute('src') ? 'src' : 'href';
+        results.push({type: el.tagName.toLowerCase(), url: el[attr]});
+    });
+    return results;
+}"""
+
+
+class HostRateLimiter:
+    """Enforce a minimum delay between navigations to the same host"""
+
+    def __init__(self, delay=1.0):
+        self.delay = delay
+        self._next_slot = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, url):
+        host = urlparse(url).netloc
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.delay
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def filter_internal_links(links, base_url):
+    """Keep only links on the base domain (or its subdomains), without duplicates"""
+    base_domain = urlparse(base_url).netloc
+    internal_links = []
+    seen = set()
+
+    for item in links:
+        try:
+            link_url = item['url']
+            if not link_url or link_url.startswith('javascript:') or link_url.startswith('data:') or link_url.startswith('#'):
+                continue
+
+            link_parsed = urlparse(link_url)
+
+            if link_parsed.netloc == base_domain or link_parsed.netloc.endswith('.' + base_domain):
+                if link_url not in seen:
+                    seen.add(link_url)
+                    internal_links.append(link_url)
+        except Exception as e:
+            print(f"⚠️ Error processing link {item['url']}: {e}")
+
+    return internal_links
+
+
+async def crawl_worker(worker_page, frontier, base_url, rate_limiter, settle_delay, registry=None):
+    """Take links from the frontier and load them in a reusable page
+
+    Links already captured in the ``registry`` (e.g. as an asset of another
+    page) are not loaded again.
+    """
+    while True:
+        item = await frontier.next()
+        if item is None:
+            return
+        link, depth = item
+        try:
+            if registry is not None and link in registry:
                 continue
+            await rate_limiter.wait(link)
+            print(f"⏬ Downloading additional link (depth {depth}): {link}")
+            await worker_page.goto(link, wait_until="domcontentloaded", timeout=30000)
+            await asyncio.sleep(settle_delay)  # Wait briefly for resources to load
+
+            if depth < frontier.max_depth:
+                links = await worker_page.evaluate(LINK_COLLECTOR_JS)
+                added = frontier.add_many(filter_internal_links(links, base_url), depth + 1)
+                if added:
+                    print(f"🔍 Found {added} new internal links on {link}")
+        except Exception as e:
+            print(f"⚠️ Error downloading link {link}: {e}")
+        finally:
+            await frontier.done(link)
+
 
-async def crawl_additional_links(page, base_url, output_dir):
-    """Find and download additional links that may be missed"""
+async def run_crawl_workers(context, frontier, base_url, setup_page=None, concurrency=4, host_delay=1.0,
+                            settle_delay=1.0, registry=None):
+    """Drain a frontier with ``concurrency`` reusable pages of a browser context"""
+    rate_limiter = HostRateLimiter(host_delay)
+    worker_pages = []
+    workers = []
     try:
-        links = await page.evaluate("""() => {
-            const results = [];
-            // Collect links from a tags
-            document.querySelectorAll('a[href]').forEach(a => {
-                results.push({type: 'a', url: a.href});
-            });
-            // Collect links from other tags that might have URLs
-            const srcElements = document.querySelectorAll('img[src], script[src], link[href], iframe[src], source[src]');
-            srcElements.forEach(el => {
-                const attr = el.hasAttribute('src') ? 'src' : 'href';
-                results.push({type: el.tagName.toLowerCase(), url: el[attr]});
-            });
-            return results;
-        }""")
-        
-        base_domain = urlparse(base_url).netloc
-        internal_links = []
-        
-        for item in links:
+        for _ in range(max(1, concurrency)):
+            worker_page = await context.new_page()
+            worker_pages.append(worker_page)
+            if setup_page:
+                await setup_page(worker_page)
+            workers.append(asyncio.create_task(
+                crawl_worker(worker_page, frontier, base_url, rate_limiter, settle_delay, registry)
+            ))
+
+        await asyncio.gather(*workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for worker_page in worker_pages:
             try:
-                link_url = item['url']
-                if not link_url or link_url.startswith('javascript:') or link_url.startswith('data:') or link_url.startswith('#'):
-                    continue
-                    
-                link_parsed = urlparse(link_url)
+                await worker_page.close()
+            except Exception:
+                pass
+
+    if frontier.exhausted():
+        print(f"⛔ Crawl budget reached: {frontier.pages} pages, {frontier.bytes} bytes ({frontier.pending()} links left)")
+    else:
+        print(f"✅ Crawl finished: {frontier.pages} pages, {frontier.bytes} bytes")
+
+
+async def crawl_additional_links(page, base_url, output_dir, setup_page=None, concurrency=4, host_delay=1.0,
+                                 settle_delay=1.0, frontier=None, registry=None):
+    """Find and download additional links that may be missed
+
+    Links are loaded by a pool of ``concurrency`` reusable pages pulling
+    from a breadth-first ``CrawlFrontier`` (or a ``SharedFrontier`` when
+    other processes crawl the same site); pages found on those pages are
+    followed until the frontier's depth, page or byte budget runs out.
+    ``setup_page`` is awaited on every new page so the caller can attach
+    its request/response handlers.
+    """
+    try:
+        if frontier is None:
+            frontier = CrawlFrontier(max_depth=1)
+
+        start_keys = {CrawlFrontier.key(page.url), CrawlFrontier.key(base_url)}
+        links = await page.evaluate(LINK_COLLECTOR_JS)
+        internal_links = [
+            link for link in filter_internal_links(links, base_url)
+            if CrawlFrontier.key(link) not in start_keys
+        ]
+        # Queue the links before marking the start page as visited, so a
+        # shared frontier never looks finished to the other processes
+        frontier.add_many(internal_links, 1)
+        for start_url in start_keys:
+            frontier.mark_visited(start_url)
 
-                if link_parsed.netloc == base_domain or link_parsed.netloc.endswith('.' + base_domain):
-                    internal_links.append(link_url)
-            except Exception as e:
-                print(f"⚠️ Error processing link {item['url']}: {e}")
-        
         print(f"🔍 Found {len(internal_links)} internal links to download")
-        
-        for link in internal_links:
-            if link not in url_to_local_path:
-                try:
-                    print(f"⏬ Downloading additional link: {link}")
-
-                    new_page = await page.context.new_page()
-                    await new_page.goto(link, wait_until="domcontentloaded", timeout=30000)
-                    await asyncio.sleep(1)  # Wait briefly for resources to load
-                    await new_page.close()
-                except Exception as e:
-                    print(f"⚠️ Error downloading link {link}: {e}")
-                    
+        if isinstance(frontier, CrawlFrontier) and not frontier.pending():
+            return
+
+        await run_crawl_workers(
+            page.context, frontier, base_url,
+            setup_page=setup_page,
+            concurrency=concurrency,
+            host_delay=host_delay,
+            settle_delay=settle_delay,
+            registry=registry
+        )
+
     except Exception as e:
-        print(f"⚠️ Error crawling additional links: {e}")
\ No newline at end of file
+        print(f"⚠️ Error crawling additional links: {e}")
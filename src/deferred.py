@@ -0,0 +1,237 @@
+import os
+import json
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .registry import UrlRegistry
+from .handlers import save_html, save_response
+from .cache import CACHE_DIR_NAME
+from .utils import load_manifest, save_manifest
+
+RAW_DIR_NAME = ".raw"
+JOBS_NAME = "jobs.jsonl"
+# Asset type of the page snapshots saved as <domain>/index.html
+SNAPSHOT = "snapshot"
+
+
+class RawStore:
+    """Raw HTML and CSS bodies kept for a rewrite pass after the capture
+
+    Bodies are written unchanged to <output>/.raw, mirroring the path they
+    will be rewritten to, and every one is listed in .raw/jobs.jsonl with
+    the URL and type needed to rewrite it later. Several threads and
+    processes can append to the same store; jobs are tagged with
+    ``run_id`` so a run only rewrites its own and not those of earlier runs
+    into the same folder, which its registry knows nothing about.
+    """
+
+    def __init__(self, output_dir, run_id=None):
+        self.output_dir = output_dir
+        self.run_id = run_id or uuid.uuid4().hex
+        self.raw_dir = os.path.join(output_dir, RAW_DIR_NAME)
+        self.jobs_path = os.path.join(self.raw_dir, JOBS_NAME)
+        self._lock = threading.Lock()
+        os.makedirs(self.raw_dir, exist_ok=True)
+
+    def raw_path(self, local_path):
+        return os.path.join(self.raw_dir, os.path.relpath(local_path, self.output_dir))
+
+    def add(self, url, content_type, body, local_path, asset_type):
+        """Keep a body for the rewrite pass instead of rewriting it now"""
+        raw_path = self.raw_path(local_path)
+        os.makedirs(os.path.dirname(raw_path), exist_ok=True)
+        with open(raw_path, "wb") as f:
+            f.write(body)
+        job = {
+            "url": url,
+            "content_type": content_type,
+            "asset_type": asset_type,
+            "path": os.path.relpath(local_path, self.output_dir).replace("\\", "/"),
+            "run": self.run_id,
+        }
+        line = json.dumps(job) + "\n"
+        with self._lock:
+            # One write per line, appends of whole lines do not interleave
+            with open(self.jobs_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        print(f"🗃 Raw body kept for rewriting: {local_path}")
+
+    def jobs(self):
+        """Rewrite jobs added in this run, by any process"""
+        return load_jobs(self.output_dir, self.run_id)
+
+
+def load_jobs(output_dir, run_id=None):
+    """Rewrite jobs of an output folder (or of one run), the last one per file wins"""
+    jobs_path = os.path.join(output_dir, RAW_DIR_NAME, JOBS_NAME)
+    jobs = {}
+    if not os.path.exists(jobs_path):
+        return []
+    with open(jobs_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError:
+                continue  # Torn last line of an interrupted run
+            if run_id is None or job.get("run") == run_id:
+                jobs[job["path"]] = job
+    return list(jobs.values())
+
+
+class UrlRegistryView:
+    """A registry with its own ``missing`` set, for rewriting in this process"""
+
+    def __init__(self, registry):
+        self._registry = registry
+        self.missing = set()
+        self.key = registry.key
+
+    def get(self, url, default=None):
+        return self._registry.get(url, default)
+
+    def add_missing(self, urls, local_path):
+        self.missing.update(urls)
+
+
+def rewrite_job(job, output_dir, registry):
+    """Rewrite one raw body into its final file
+
+    Returns (links, missing URLs, links left remote).
+
+    ``registry.missing`` collects the URLs that were never captured, so it
+    should be a fresh set for every job.
+    """
+    local_path = os.path.join(output_dir, job["path"])
+    raw_path = job.get("source") or os.path.join(output_dir, RAW_DIR_NAME, job["path"])
+    with open(raw_path, "rb") as f:
+        body = f.read()
+    unresolved = set()
+    if job["asset_type"] == SNAPSHOT:
+        embedded_dir = os.path.join(os.path.dirname(local_path), "assets", "html", "embedded")
+        links = save_html(body.decode("utf-8", errors="ignore"), job["url"], local_path, embedded_dir,
+                          "html_embedded", registry, unresolved=unresolved)
+    else:
+        links = save_response(job["url"], job["content_type"], body, local_path, job["asset_type"], registry,
+                              unresolved=unresolved)
+    return links or {}, registry.missing, unresolved
+
+
+_worker_registry = None
+
+
+def _init_worker(snapshot):
+    global _worker_registry
+    _worker_registry = UrlRegistry()
+    for key, local_path in snapshot.items():
+        _worker_registry.register(key, local_path)
+
+
+def _rewrite_in_worker(job, output_dir):
+    _worker_registry.missing = set()
+    try:
+        return rewrite_job(job, output_dir, _worker_registry)
+    except Exception as e:
+        print(f"⚠️ Error rewriting {job['path']}: {e}")
+        return {}, set(), set()
+
+
+def rewrite_deferred(output_dir, registry, workers=None, jobs=None):
+    """Rewrite every kept HTML and CSS body against the complete registry
+
+    Runs in a pool of ``workers`` processes (default: one per CPU), each
+    with a snapshot of the registry. Links found are added to the registry
+    entries, and URLs that were never captured to ``registry.missing``.
+    Returns the number of files rewritten.
+    """
+    if jobs is None:
+        jobs = load_jobs(output_dir)
+    if not jobs:
+        return 0
+    # Starting a process costs more than rewriting a few small files
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) // 16))
+    print(f"✏️ Rewriting {len(jobs)} HTML/CSS files with {workers} processes...")
+
+    if workers == 1:
+        results = []
+        for job in jobs:
+            try:
+                results.append(rewrite_job(job, output_dir, UrlRegistryView(registry)))
+            except Exception as e:
+                print(f"⚠️ Error rewriting {job['path']}: {e}")
+                results.append(({}, set(), set()))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(registry.snapshot(),)
+        ) as pool:
+            results = list(pool.map(_rewrite_in_worker, jobs, [output_dir] * len(jobs), chunksize=8))
+
+    for job, (links, missing, unresolved) in zip(jobs, results):
+        registry.add_missing(missing, os.path.join(output_dir, job["path"]))
+        if job["asset_type"] != SNAPSHOT and (links or unresolved):
+            registry.update_entry(job["url"], links=links, unresolved=sorted(unresolved))
+    return len(jobs)
+
+
+def rewrite_mirror(output_dir, workers=None):
+    """Rewrite the HTML and CSS of an existing mirror again, without a browser
+
+    The URL map comes from <output>/manifest.json. Original bodies are
+    taken from .raw (page snapshots, and everything with --deferred-rewrite)
+    or else from the capture cache; files with neither are left as they are
+    and counted. The manifest is saved
+    again with the new links. Returns the number of files rewritten.
+    """
+    manifest = load_manifest(output_dir)
+    if not manifest:
+        print(f"❌ No manifest found in {output_dir}")
+        return 0
+
+    registry = UrlRegistry()
+    for url, entry in manifest.items():
+        entry = dict(entry)
+        local_path = os.path.join(output_dir, entry.pop("path"))
+        entry["links"] = {
+            link: os.path.join(output_dir, link_path) for link, link_path in entry.get("links", {}).items()
+        }
+        registry.register(url, local_path, entry)
+
+    jobs = {job["path"]: job for job in load_jobs(output_dir)}
+    skipped = 0
+    for url, entry in manifest.items():
+        content_type = entry.get("content_type", "")
+        if entry["path"] in jobs or not ("text/html" in content_type or "text/css" in content_type):
+            continue
+        source = os.path.join(output_dir, CACHE_DIR_NAME, "blobs", entry.get("hash", ""))
+        if not entry.get("hash") or not os.path.exists(source):
+            skipped += 1
+            continue
+        jobs[entry["path"]] = {
+            "url": url,
+            "content_type": content_type,
+            "asset_type": "html" if "text/html" in content_type else "css",
+            "path": entry["path"],
+            "source": source,
+        }
+    # Snapshots of mirrors made before they were kept in .raw
+    for domain in {path.split("/", 1)[0] for path in (entry["path"] for entry in manifest.values())}:
+        snapshot_path = f"{domain}/index.html"
+        if snapshot_path not in jobs and os.path.isfile(os.path.join(output_dir, snapshot_path)):
+            skipped += 1
+    if skipped:
+        print(f"⚠️ {skipped} HTML/CSS files (page snapshots included) have no original body in .raw "
+              f"or the cache, left unchanged")
+
+    rewritten = rewrite_deferred(output_dir, registry, workers, list(jobs.values()))
+    print(f"📄 Manifest saved: {save_manifest(output_dir, registry, manifest)}")
+    not_captured = registry.not_captured()
+    if not_captured:
+        print(f"🔎 {len(not_captured)} assets referenced in HTML/CSS were not captured")
+    return rewritten
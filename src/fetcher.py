@@ -0,0 +1,141 @@
+import os
+import asyncio
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from .utils import content_hash
+from .handlers import asset_type_of, asset_file_name, make_persist
+from .rewriter import rewrite_css_urls, rewrite_html_links
+
+
+class DirectFetcher:
+    """Download static assets without a browser tab
+
+    Requests go through an ``APIRequestContext``. The one of a browser
+    context (``context.request``) carries its cookies and reuses its
+    keep-alive connections, but skips rendering and the tab overhead. At
+    most ``host_connections`` requests run against one host at a time, and
+    ``concurrency`` overall. Assets are saved in the folder of ``domain``,
+    or of their own host when it is None. With a ``domain``, only URLs
+    referenced by files of that site are fetched, so sites of a batch
+    never download each other's assets with their own cookies.
+    """
+
+    def __init__(self, request, output_dir, domain, registry, writer=None, cache=None, request_filter=None,
+                 host_connections=6, concurrency=16, timeout_ms=30000, fanout=False):
+        self.request = request
+        self.output_dir = output_dir
+        self.domain = domain
+        self.registry = registry
+        self.writer = writer
+        self.cache = cache
+        self.request_filter = request_filter
+        self.timeout_ms = timeout_ms
+        self.fanout = fanout
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._hosts = defaultdict(lambda: asyncio.Semaphore(max(1, host_connections)))
+
+    async def fetch(self, url):
+        """Download one URL and queue it for saving, return True on success"""
+        if self.request_filter and self.request_filter.check(url):
+            return False
+        host = urlsplit(url).hostname or ""
+        async with self._slots, self._hosts[host]:
+            try:
+                response = await self.request.get(url, timeout=self.timeout_ms)
+                if not response.ok:
+                    print(f"⚠️ Direct fetch got {response.status}: {url}")
+                    return False
+                headers = response.headers
+                if self.request_filter and self.request_filter.too_large(url, headers):
+                    print(f"🚫 Skip (too large): {url}")
+                    return False
+                body = await response.body()
+            except Exception as e:
+                print(f"⚠️ Direct fetch failed: {url} ({e})")
+                return False
+
+        content_type = (headers.get("content-type") or "").lower()
+        asset_type = asset_type_of(content_type, url)
+        asset_dir = os.path.join(self.output_dir, self.domain or urlsplit(url).netloc, "assets", asset_type)
+        body_hash = content_hash(body)
+        local_path = os.path.join(asset_dir, asset_file_name(url, content_type, asset_type, body_hash, self.fanout))
+        self.registry.register(url, local_path, {"hash": body_hash, "content_type": content_type})
+
+        persist = make_persist(
+            url, headers, content_type, body, body_hash, local_path, asset_type, self.output_dir, self.registry,
+            cache=self.cache
+        )
+        if self.writer:
+            await self.writer.submit(persist)
+        else:
+            persist()
+        return True
+
+    async def fetch_missing(self, rounds=3):
+        """Fetch URLs referenced by saved HTML and CSS but never requested by the page
+
+        Stylesheets fetched this way can reference more assets, so this
+        repeats for up to ``rounds`` rounds. Files saved before are not
+        relinked here; call ``relink_documents`` once nothing else is being
+        written. Returns the number of assets fetched.
+        """
+        attempted = set()
+        fetched = 0
+        for _ in range(rounds):
+            site_dir = os.path.join(self.output_dir, self.domain) if self.domain else None
+            urls = self.registry.not_captured(site_dir) - attempted
+            if not urls:
+                break
+            attempted |= urls
+            print(f"⚡ Fetching {len(urls)} uncaptured assets directly")
+            results = await asyncio.gather(*(self.fetch(url) for url in urls))
+            fetched += sum(results)
+            if self.writer:
+                await self.writer.drain()
+        if fetched:
+            print(f"⚡ {fetched} assets fetched directly")
+        return fetched
+
+
+def relink_documents(registry, pages=()):
+    """Rewrite saved HTML and CSS again so they point at assets captured later
+
+    Must only run once every capture and writer is done, files are
+    rewritten in place. ``pages`` are extra (URL, path) HTML files that are
+    not in the registry, such as page snapshots. Links that were rewritten
+    before are already relative paths that no longer resolve to a captured
+    URL, so they are left as they are. Returns the number of files that
+    changed.
+    """
+    documents = [
+        (key, local_path, entry) for key, local_path, entry in registry.items()
+        if "text/css" in entry.get("content_type", "") or "text/html" in entry.get("content_type", "")
+    ]
+    documents += [(url, path, None) for url, path in pages]
+    changed = 0
+    for key, local_path, entry in documents:
+        if not os.path.exists(local_path):
+            continue
+        with open(local_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        resolved = {}
+        base_dir = os.path.dirname(local_path)
+        if entry is not None and "text/css" in entry.get("content_type", ""):
+            new_text = rewrite_css_urls(text, key, base_dir, registry, resolved)
+        else:
+            new_text = rewrite_html_links(text, key, base_dir, registry, resolved)
+        if new_text == text:
+            continue
+        with open(local_path, "w", encoding="utf-8") as f:
+            f.write(new_text)
+        if entry is not None:
+            registry.update_entry(
+                key,
+                links={**entry.get("links", {}), **resolved},
+                unresolved=[link for link in entry.get("unresolved", []) if link not in resolved]
+            )
+        changed += 1
+    if changed:
+        print(f"🔗 {changed} HTML/CSS files relinked")
+    return changed
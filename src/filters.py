@@ -0,0 +1,140 @@
+import os
+import re
+import argparse
+from urllib.parse import urlsplit
+
+# Substrings of URLs that are never worth downloading (manifest, tracking, ads)
+DEFAULT_SKIP_PATTERNS = [
+    "manifest.json",
+    "google-analytics.com",
+    "analytics.",
+    "tracker.",
+    "tracking.",
+    "adservice.",
+    "pagead",
+    "doubleclick.net"
+]
+# Playwright resource types that can be blocked with --block-types
+RESOURCE_TYPES = {
+    "stylesheet", "image", "media", "font", "script", "texttrack", "xhr", "fetch",
+    "eventsource", "websocket", "manifest", "other"
+}
+
+
+class DomainTrie:
+    """Set of domains matched label by label from the right
+
+    A blocked domain also blocks all of its subdomains, so checking a host
+    costs one dict lookup per label no matter how long the blocklist is.
+    """
+
+    END = "$"
+
+    def __init__(self, domains=()):
+        self.root = {}
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain):
+        node = self.root
+        for label in reversed(domain.strip().lower().strip(".").split(".")):
+            node = node.setdefault(label, {})
+        node[self.END] = True
+
+    def matches(self, host):
+        """True if the host or one of its parent domains is in the trie"""
+        node = self.root
+        for label in reversed(host.lower().split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if self.END in node:
+                return True
+        return False
+
+    def __bool__(self):
+        return bool(self.root)
+
+
+def compile_patterns(patterns):
+    """One regex alternation of literal substrings, scanned in a single pass"""
+    patterns = [pattern for pattern in patterns if pattern]
+    if not patterns:
+        return None
+    # Longest first so overlapping literals report the most specific match
+    return re.compile("|".join(re.escape(pattern) for pattern in sorted(patterns, key=len, reverse=True)))
+
+
+def read_domain_list(value):
+    """Parse --block-domains: comma separated domains, or a blocklist file
+
+    Files may contain one domain per line or hosts-file entries such as
+    ``0.0.0.0 ads.example.com``; ``#`` starts a comment.
+    """
+    if os.path.isfile(value):
+        domains = []
+        with open(value, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.split("#", 1)[0].split()
+                if line:
+                    domains.append(line[-1])
+        return domains
+    return [domain.strip() for domain in value.split(",") if domain.strip()]
+
+
+def parse_resource_types(value):
+    """Parse --block-types, e.g. ``media,font``"""
+    types = {item.strip().lower() for item in value.split(",") if item.strip()}
+    unknown = types - RESOURCE_TYPES
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown resource types: {', '.join(sorted(unknown))}")
+    return types
+
+
+class RequestFilter:
+    """Decides which requests are aborted before they reach the network
+
+    A request is skipped when its host is in ``block_domains`` (or a
+    subdomain of one), its URL contains one of ``skip_patterns``, or its
+    Playwright resource type is in ``block_types``. Documents are never
+    blocked by type or size. Responses announcing a Content-Length above
+    ``max_response_size`` are not saved, and later requests for the same
+    URL are aborted.
+    """
+
+    def __init__(self, block_domains=(), block_types=(), max_response_size=None,
+                 skip_patterns=DEFAULT_SKIP_PATTERNS):
+        self.domains = DomainTrie(block_domains)
+        self.patterns = compile_patterns(skip_patterns)
+        self.block_types = set(block_types) - {"document"}
+        self.max_response_size = max_response_size
+        self.oversized = set()
+
+    def check(self, url, resource_type=None):
+        """Reason to skip a request, or None if it may go to the network"""
+        if resource_type in self.block_types:
+            return f"type {resource_type}"
+        if url in self.oversized:
+            return "too large"
+        if self.domains:
+            host = urlsplit(url).hostname or ""
+            if self.domains.matches(host):
+                return f"domain {host}"
+        if self.patterns:
+            match = self.patterns.search(url)
+            if match:
+                return f"pattern {match.group(0)}"
+        return None
+
+    def too_large(self, url, headers, resource_type=None):
+        """True if the response is bigger than allowed according to its headers"""
+        if self.max_response_size is None or resource_type == "document":
+            return False
+        try:
+            size = int(headers.get("content-length", ""))
+        except ValueError:
+            return False
+        if size > self.max_response_size:
+            self.oversized.add(url)
+            return True
+        return False
@@ -0,0 +1,290 @@
+import os
+import json
+import heapq
+import asyncio
+import sqlite3
+import hashlib
+import itertools
+import threading
+
+from .registry import normalize_url
+
+
+class CrawlFrontier:
+    """Breadth-first crawl frontier with depth, page and byte budgets
+
+    URLs are deduplicated by their registry key (see normalize_url:
+    fragments, tracking parameters and default ports are ignored) and
+    handed out lowest depth first, so the crawl always finishes a level
+    before descending further.
+    """
+
+    def __init__(self, max_depth=1, max_pages=None, max_bytes=None):
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.seen = set()
+        self.pages = 0
+        self.bytes = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._in_progress = 0
+        self._changed = None
+
+    key = staticmethod(normalize_url)
+
+    def add(self, url, depth):
+        """Queue a URL found at the given depth, return True if it was new"""
+        if depth > self.max_depth:
+            return False
+        key = self.key(url)
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        heapq.heappush(self._heap, (depth, next(self._seq), key))
+        return True
+
+    def add_many(self, urls, depth):
+        """Queue several URLs, return how many were new"""
+        return sum(self.add(url, depth) for url in urls)
+
+    def mark_visited(self, url):
+        """Record a page that was loaded outside the frontier (e.g. the start page)"""
+        key = self.key(url)
+        if key not in self.seen:
+            self.seen.add(key)
+            self.pages += 1
+
+    def record_bytes(self, size):
+        self.bytes += size
+
+    def exhausted(self):
+        if self.max_pages is not None and self.pages >= self.max_pages:
+            return True
+        if self.max_bytes is not None and self.bytes >= self.max_bytes:
+            return True
+        return False
+
+    def pending(self):
+        return len(self._heap)
+
+    async def next(self):
+        """Wait for the next (url, depth) to visit, or None when the crawl is over"""
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        async with self._changed:
+            while True:
+                if self.exhausted():
+                    return None
+                if self._heap:
+                    depth, _, url = heapq.heappop(self._heap)
+                    self._in_progress += 1
+                    self.pages += 1
+                    return url, depth
+                if self._in_progress == 0:
+                    return None
+                await self._changed.wait()
+
+    async def done(self, url):
+        """Mark a URL returned by next() as finished"""
+        async with self._changed:
+            self._in_progress -= 1
+            self._changed.notify_all()
+
+
+def shard_of(url, shards):
+    """Pick the worker process that owns a URL"""
+    digest = hashlib.sha1(CrawlFrontier.key(url).encode()).hexdigest()
+    return int(digest[:8], 16) % shards
+
+
+class SharedFrontier:
+    """Crawl frontier shared by several processes through an SQLite index
+
+    Every process owns the URLs whose hash falls in its shard but may
+    discover URLs for any shard; the primary key of the index deduplicates
+    them across processes. Page and byte budgets are global. The crawl is
+    over when no URL is pending or being visited in any shard.
+
+    The index doubles as a write-ahead journal: it also records every file
+    saved to disk, so an interrupted crawl can be resumed from it.
+    """
+
+    def __init__(self, db_path, shard, shards, max_depth=1, max_pages=None, max_bytes=None, poll_interval=0.5):
+        self.db_path = db_path
+        self.shard = shard
+        self.shards = shards
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self._unflushed_bytes = 0
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # Saved files are journaled from the writer threads
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                depth INTEGER NOT NULL,
+                shard INTEGER NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending'
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS urls_by_shard ON urls (shard, state, depth)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage (
+                shard INTEGER PRIMARY KEY,
+                pages INTEGER NOT NULL DEFAULT 0,
+                bytes INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS saved (
+                url TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                entry TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("INSERT OR IGNORE INTO usage (shard) VALUES (?)", (shard,))
+        self._conn.commit()
+
+    def reset_active(self):
+        """Put URLs that were being visited when a previous run died back in the queue"""
+        with self._lock, self._conn:
+            return self._conn.execute("UPDATE urls SET state = 'pending' WHERE state = 'active'").rowcount
+
+    def counts(self):
+        """Number of URLs per state"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT state, COUNT(*) FROM urls GROUP BY state").fetchall())
+
+    def record_saved(self, url, path, entry):
+        """Journal a file once it is on disk (path relative to the output folder)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO saved (url, path, entry) VALUES (?, ?, ?)",
+                (url, path, json.dumps(entry))
+            )
+
+    def load_saved(self):
+        """Yield (url, path, entry) of every journaled file"""
+        with self._lock:
+            rows = self._conn.execute("SELECT url, path, entry FROM saved").fetchall()
+        for url, path, entry in rows:
+            yield url, path, json.loads(entry)
+
+    @property
+    def pages(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(pages), 0) FROM usage").fetchone()[0]
+
+    @property
+    def bytes(self):
+        self._flush_bytes()
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM usage").fetchone()[0]
+
+    def seed(self, url):
+        """Register the start page as being visited, so other processes wait for its links
+
+        A start page already done in a resumed journal stays done, so it is
+        not counted against the page budget again.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO urls (url, depth, shard, state) VALUES (?, 0, ?, 'active') "
+                "ON CONFLICT(url) DO UPDATE SET state = 'active' WHERE state != 'done'",
+                (CrawlFrontier.key(url), shard_of(url, self.shards))
+            )
+
+    def add(self, url, depth):
+        """Queue a URL found at the given depth, return True if it was new"""
+        return self.add_many([url], depth) == 1
+
+    def add_many(self, urls, depth):
+        """Queue several URLs in one transaction, return how many were new"""
+        if depth > self.max_depth:
+            return 0
+        rows = [(CrawlFrontier.key(url), depth, shard_of(url, self.shards)) for url in urls]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO urls (url, depth, shard) VALUES (?, ?, ?)", rows)
+            return self._conn.total_changes - before
+
+    def mark_visited(self, url):
+        """Record a page that was loaded outside the frontier (e.g. the start page)"""
+        key = CrawlFrontier.key(url)
+        with self._lock, self._conn:
+            cursor = self._conn.execute("UPDATE urls SET state = 'done' WHERE url = ? AND state != 'done'", (key,))
+            if cursor.rowcount == 0:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO urls (url, depth, shard, state) VALUES (?, 0, ?, 'done')",
+                    (key, shard_of(url, self.shards))
+                )
+            if cursor.rowcount:
+                self._conn.execute("UPDATE usage SET pages = pages + 1 WHERE shard = ?", (self.shard,))
+
+    def record_bytes(self, size):
+        self._unflushed_bytes += size
+
+    def _flush_bytes(self):
+        if self._unflushed_bytes:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE usage SET bytes = bytes + ? WHERE shard = ?",
+                    (self._unflushed_bytes, self.shard)
+                )
+            self._unflushed_bytes = 0
+
+    def exhausted(self):
+        if self.max_pages is not None and self.pages >= self.max_pages:
+            return True
+        if self.max_bytes is not None and self.bytes >= self.max_bytes:
+            return True
+        return False
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM urls WHERE shard = ? AND state = 'pending'", (self.shard,)
+            ).fetchone()[0]
+
+    def _claim(self):
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT url, depth FROM urls WHERE shard = ? AND state = 'pending' ORDER BY depth LIMIT 1",
+                (self.shard,)
+            ).fetchone()
+            if row:
+                self._conn.execute("UPDATE urls SET state = 'active' WHERE url = ?", (row[0],))
+                self._conn.execute("UPDATE usage SET pages = pages + 1 WHERE shard = ?", (self.shard,))
+        return row
+
+    async def next(self):
+        """Wait for the next (url, depth) of this shard, or None when the crawl is over"""
+        while True:
+            if self.exhausted():
+                return None
+            row = self._claim()
+            if row:
+                return row[0], row[1]
+            with self._lock:
+                unfinished = self._conn.execute(
+                    "SELECT COUNT(*) FROM urls WHERE state IN ('pending', 'active')"
+                ).fetchone()[0]
+            if unfinished == 0:
+                return None
+            await asyncio.sleep(self.poll_interval)
+
+    async def done(self, url):
+        """Mark a URL returned by next() as finished"""
+        self._flush_bytes()
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE urls SET state = 'done' WHERE url = ?", (CrawlFrontier.key(url),))
+
+    def close(self):
+        self._flush_bytes()
+        with self._lock:
+            self._conn.close()
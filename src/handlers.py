@@ -1,134 +1,555 @@
 import os
-from .utils import hash_path, extract_and_replace_data_uri, url_to_local_path
-from .rewriter import rewrite_html_links, rewrite_css_urls
+import time
+import base64
+import asyncio
+import hashlib
+import itertools
+from .utils import (
+    hash_path, content_hash, blob_name, fanout_path,
+    extract_and_replace_data_uri
+)
+from .rewriter import rewrite_html_links, rewrite_css_stream, CSS_CHUNK_SIZE
+from .filters import RequestFilter
+from .storage import LOCAL_FILES
 from urllib.parse import urlparse
 
+# Bodies announced larger than this are streamed to disk in chunks
+# instead of being buffered whole by response.body()
+STREAM_THRESHOLD = 8 << 20
+STREAM_CHUNK_SIZE = 1 << 20
+
+# Encode a Uint8Array as base64 in slices, String.fromCharCode has an argument limit
+BASE64_JS = """const toBase64 = bytes => {
+    let binary = "";
+    for (let i = 0; i < bytes.length; i += 0x8000) {
+        binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+    }
+    return btoa(binary);
+};"""
+STREAM_OPEN_JS = """async url => {
+    try {
+        const r = await fetch(url);
+        if (!r.ok || !r.body) return null;
+        const streams = window.__clonerStreams || (window.__clonerStreams = {});
+        const id = Date.now().toString(36) + Math.random().toString(36).slice(2);
+        streams[id] = {reader: r.body.getReader(), rest: null};
+        return id;
+    } catch (e) { return null; }
+}"""
+STREAM_READ_JS = """async ([id, size]) => {
+    %s
+    const streams = window.__clonerStreams || {};
+    const stream = streams[id];
+    if (!stream) return null;
+    const parts = stream.rest ? [stream.rest] : [];
+    let length = stream.rest ? stream.rest.length : 0;
+    let done = false;
+    stream.rest = null;
+    while (length < size) {
+        const step = await stream.reader.read();
+        if (step.done) { done = true; break; }
+        parts.push(step.value);
+        length += step.value.length;
+    }
+    if (done) delete streams[id];
+    if (length > size) {
+        // Keep what does not fit for the next call, chunks stay bounded
+        const last = parts.pop();
+        const keep = last.length - (length - size);
+        parts.push(last.subarray(0, keep));
+        stream.rest = last.subarray(keep);
+        length = size;
+    }
+    const bytes = new Uint8Array(length);
+    let offset = 0;
+    for (const part of parts) { bytes.set(part, offset); offset += part.length; }
+    return {data: toBase64(bytes), done};
+}""" % BASE64_JS
+STREAM_CANCEL_JS = """id => {
+    const streams = window.__clonerStreams || {};
+    if (streams[id]) { streams[id].reader.cancel(); delete streams[id]; }
+}"""
+_stream_ids = itertools.count()
+
+
+FETCH_BASE64_JS = """async url => {
+    %s
+    try {
+        const r = await fetch(url);
+        const b = await r.arrayBuffer();
+        return toBase64(new Uint8Array(b));
+    } catch(e){ return null; }
+}""" % BASE64_JS
+
+
 async def fetch_fallback(page, url):
-    """Fallback fetch method if normal response.body() fails"""
+    """Fallback fetch method if normal response.body() fails
+
+    The URL is fetched again through the request context of the page,
+    which shares its cookies and returns raw bytes. If that fails, the page
+    itself fetches it and hands the body over as base64.
+    """
     try:
-        data = await page.evaluate(
-            """async url => {
-                try {
-                    const r = await fetch(url);
-                    const b = await r.arrayBuffer();
-                    return Array.from(new Uint8Array(b));
-                } catch(e){ return null; }
-            }""",
-            url
-        )
+        response = await page.context.request.get(url)
+        if response.ok:
+            return await response.body()
+    except Exception:
+        pass
+    try:
+        data = await page.evaluate(FETCH_BASE64_JS, url)
         if data:
-            return bytes(data)
+            return base64.b64decode(data)
     except Exception:
         pass
     return None
 
 
-async def create_response_handler(page, output_dir):
-    """Create handler for responses"""
-    async def handle_response(response):
+async def stream_to_file(page, url, path):
+    """Download a body through the page in base64 chunks straight into a file
+
+    Only one chunk is held in memory at a time. Returns (size, content
+    hash), or None if the page could not fetch the URL.
+    """
+    stream_id = await page.evaluate(STREAM_OPEN_JS, url)
+    if stream_id is None:
+        return None
+    digest = hashlib.sha1()
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while True:
+                chunk = await page.evaluate(STREAM_READ_JS, [stream_id, STREAM_CHUNK_SIZE])
+                if chunk is None:
+                    return None
+                data = base64.b64decode(chunk["data"])
+                digest.update(data)
+                await asyncio.to_thread(f.write, data)
+                size += len(data)
+                if chunk["done"]:
+                    break
+    except BaseException:
         try:
-            content_type = (response.headers.get("content-type") or "").lower()
-            try:
-                body = await response.body()
-            except Exception:
-                print(f"⚠️ Normal fetch failed, falling back for: {response.url}")
-                body = await fetch_fallback(page, response.url)
-                if not body:
-                    print(f"❌ Cannot fetch: {response.url}")
-                    return
+            await page.evaluate(STREAM_CANCEL_JS, stream_id)
+        except Exception:
+            pass
+        raise
+    return size, digest.hexdigest()
+
+
+async def stream_response(page, url, asset_dir, content_type, sink=LOCAL_FILES, fanout=False):
+    """Save a large asset without buffering it, named after its content
+
+    Returns (local path, content hash, size), or None to fall back to the
+    buffered path.
+    """
+    tmp_dir = sink.temp_dir(os.path.join(asset_dir, "stream"))
+    tmp_path = os.path.join(tmp_dir, f".stream-{os.getpid()}-{next(_stream_ids)}.tmp")
+    try:
+        result = await stream_to_file(page, url, tmp_path)
+    except Exception as e:
+        print(f"⚠️ Streaming failed, buffering instead: {url} ({e})")
+        result = None
+    if result is None:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+    size, body_hash = result
+    local_path = os.path.join(asset_dir, asset_file_name(url, content_type, None, body_hash, fanout))
+    try:
+        moved = await asyncio.to_thread(sink.move_in, local_path, tmp_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if moved:
+        print(f"📥 Saved (streamed {size} bytes): {local_path}")
+    else:
+        print(f"♻️ Duplicate content, reusing: {local_path}")
+    return local_path, body_hash, size
+
+
+def save_html(text_content, base_url, local_path, embedded_dir, embedded_prefix, registry, sink=LOCAL_FILES,
+              unresolved=None):
+    """Rewrite links, extract data URIs and write an HTML document
+
+    Returns the links that were rewritten to local files. Links left
+    remote are added to the ``unresolved`` set when one is given. Data URIs
+    are extracted last, so their local paths are never taken for links.
+    """
+    resolved = {}
+    missing = set()
+    text_content = rewrite_html_links(
+        text_content, base_url, os.path.dirname(local_path), registry, resolved, missing, unresolved
+    )
+    registry.add_missing(missing, local_path)
+    text_content = extract_and_replace_data_uri(
+        text_content, embedded_dir, embedded_prefix, os.path.dirname(local_path), sink
+    )
+    with sink.open(local_path) as f:
+        f.write(text_content.encode("utf-8"))
+    return resolved
+
+
+def is_unchanged(url, body_hash, local_path, previous, output_dir, registry):
+    """Check a response against the manifest of the previous run
+
+    A file is unchanged when its body hash and location are the same,
+    every link it was rewritten with still points at the same local file
+    and none of the links it left remote has been captured since.
+    """
+    entry = previous.get(registry.key(url))
+    if not entry or entry.get("hash") != body_hash:
+        return False
+    if os.path.normpath(os.path.join(output_dir, entry["path"])) != os.path.normpath(local_path):
+        return False
+    if not os.path.exists(local_path):
+        return False
+    for link, rel_path in entry.get("links", {}).items():
+        current = registry.get(link)
+        if current and os.path.normpath(os.path.relpath(current, output_dir)) != os.path.normpath(rel_path):
+            return False
+    for link in entry.get("unresolved", ()):
+        if link in registry:
+            return False
+    return True
+
+
+def recheck_unchanged(registry, cache=None):
+    """Rewrite documents skipped as unchanged whose links moved during the capture
+
+    is_unchanged runs when a document arrives, usually before the assets it
+    links to are captured. Once the capture is done, the links of every
+    skipped document are compared with the final registry, and a document
+    with a moved target or a newly captured remote link is rewritten from
+    its original body in the capture ``cache``. Returns the number of
+    documents rewritten.
+    """
+    rewritten = stale = 0
+    documents = [item for item in registry.items() if item[0] in registry.unchanged]
+    for key, local_path, entry in documents:
+        moved = any(
+            os.path.normpath(registry.get(link, path)) != os.path.normpath(path)
+            for link, path in entry.get("links", {}).items()
+        ) or any(link in registry for link in entry.get("unresolved", ()))
+        if not moved:
+            continue
+        blob = cache.blob_path(entry.get("hash", "")) if cache else None
+        if not blob or not os.path.exists(blob):
+            stale += 1
+            continue
+        with open(blob, "rb") as f:
+            body = f.read()
+        content_type = entry.get("content_type", "")
+        unresolved = set()
+        links = save_response(key, content_type, body, local_path, asset_type_of(content_type, key), registry,
+                              unresolved=unresolved)
+        registry.update_entry(key, links=links or {}, unresolved=sorted(unresolved))
+        rewritten += 1
+    registry.unchanged.clear()
+    if rewritten:
+        print(f"🔁 {rewritten} unchanged files rewritten, assets they link to changed")
+    if stale:
+        print(f"⚠️ {stale} unchanged files link to changed assets but have no cached body, left as they are")
+    return rewritten
+
+
+def save_response(url, content_type, body, local_path, asset_type, registry, sink=LOCAL_FILES, unresolved=None):
+    """Write a captured response body to the sink, rewriting HTML and CSS
+
+    Runs in a writer thread, so it must not touch the page. Returns the
+    links that were rewritten to local files for HTML and CSS, else None;
+    the links they left remote are added to ``unresolved``.
+    """
+    resolved = None
+    # Save data URIs in domain/assets/asset_type/embedded folder
+    embedded_dir = os.path.join(os.path.dirname(local_path), "embedded")
+
+    if "text/html" in content_type:
+        text_content = body.decode("utf-8", errors="ignore")
+        resolved = save_html(
+            text_content, url, local_path, embedded_dir, f"{asset_type}_embedded", registry, sink, unresolved
+        )
+    elif "text/css" in content_type:
+        text_content = body.decode("utf-8", errors="ignore")
+        resolved = {}
+        missing = set()
+        chunks = (text_content[i:i + CSS_CHUNK_SIZE] for i in range(0, len(text_content), CSS_CHUNK_SIZE))
+        with sink.open(local_path) as f:
+            css_chunks = rewrite_css_stream(chunks, url, os.path.dirname(local_path), registry, resolved, missing)
+            for chunk in css_chunks:
+                # Extracted after rewriting, so the rewriter never sees the embedded/ paths
+                chunk = extract_and_replace_data_uri(
+                    chunk,
+                    embedded_dir,
+                    f"{asset_type}_embedded",
+                    os.path.dirname(local_path),
+                    sink
+                )
+                f.write(chunk.encode("utf-8"))
+        registry.add_missing(missing, local_path)
+        if unresolved is not None:
+            unresolved.update(missing)
+    else:
+        if not sink.write_once(local_path, body):
+            print(f"♻️ Duplicate content, reusing: {local_path}")
+            return None
+
+    print(f"📥 Saved: {local_path}")
+    return resolved
+
+
+def asset_type_of(content_type, url):
+    """Folder under domain/assets a response is saved in"""
+    if "text/html" in content_type:
+        return "html"
+    elif "text/css" in content_type:
+        return "css"
+    elif "text/javascript" in content_type or "application/javascript" in content_type:
+        return "js"
+    elif "image/" in content_type:
+        return "images"
+    elif "font/" in content_type or "application/font" in content_type or ".woff" in url or ".ttf" in url:
+        return "fonts"
+    elif "video/" in content_type:
+        return "videos"
+    elif "audio/" in content_type:
+        return "audio"
+    elif "application/json" in content_type:
+        return "json"
+    return "misc"  # Default folder for unrecognized types
+
+
+def asset_file_name(url, content_type, asset_type, body_hash, fanout=False):
+    """Name of the file a body is saved as, relative to its asset folder
+
+    HTML and CSS are rewritten relative to their own URL, so they are named
+    after it; everything else after its content, so the same asset behind
+    different URLs is stored once. With ``fanout`` the name is nested in
+    two levels of folders taken from the hash.
+    """
+    if asset_type in ("html", "css"):
+        file_name = hash_path(url, content_type)
+    else:
+        file_name = blob_name(body_hash, content_type)
+    return fanout_path(file_name) if fanout else file_name
+
 
+def make_persist(url, headers, content_type, body, body_hash, local_path, asset_type, output_dir, registry,
+                 cache=None, previous=None, journal=None, written=False, raw_store=None, sink=LOCAL_FILES):
+    """Job that saves one registered body, to run inline or in a ResponseWriter
+
+    ``written`` marks a body that is already on disk (streamed). A ``cache``
+    is only given for responses worth caching. With a ``raw_store``, HTML
+    and CSS are kept raw for a later rewrite pass instead. Files are
+    written to ``sink``.
+    """
+    def persist():
+        links = None
+        unresolved = set()
+        if written:
+            pass  # Already written while streaming
+        elif raw_store is not None and asset_type in ("html", "css"):
+            raw_store.add(url, content_type, body, local_path, asset_type)
+        elif previous is not None and is_unchanged(url, body_hash, local_path, previous, output_dir, registry):
+            print(f"⏭ Unchanged: {local_path}")
+            registry.unchanged.add(registry.key(url))
+            previous_entry = previous[registry.key(url)]
+            previous_links = previous_entry.get("links")
+            if previous_links:
+                links = {
+                    link: os.path.join(output_dir, rel_path) for link, rel_path in previous_links.items()
+                }
+            unresolved.update(previous_entry.get("unresolved", ()))
+        else:
+            links = save_response(url, content_type, body, local_path, asset_type, registry, sink, unresolved)
+        if links:
+            registry.update_entry(url, links=links)
+        if unresolved:
+            registry.update_entry(url, unresolved=sorted(unresolved))
+        if cache:
+            link_from = None if asset_type in ("html", "css") else local_path
+            cache.store(url, headers, body, body_hash, link_from)
+        if journal:
+            journal.record_saved(url, os.path.relpath(local_path, output_dir), {
+                "hash": body_hash,
+                "content_type": content_type,
+                "links": {
+                    link: os.path.relpath(path, output_dir) for link, path in (links or {}).items()
+                },
+                "unresolved": sorted(unresolved)
+            })
+
+    return persist
+
+
+async def create_response_handler(page, output_dir, registry, on_saved=None, writer=None, cache=None, previous=None,
+                                  journal=None, request_filter=None, raw_store=None, sink=LOCAL_FILES,
+                                  fanout=False):
+    """Create handler for responses
+
+    Every captured URL is registered in the ``UrlRegistry`` of the clone.
+
+    ``on_saved(url, size)`` is called after every body has been fetched,
+    which lets the crawl frontier account for its byte budget. When a
+    ``ResponseWriter`` is given, the handler only captures the body and
+    queues the rewriting and disk writes on it. Successful GET responses
+    are also recorded in ``cache`` for the next run. In incremental mode
+    ``previous`` is the manifest of the last run, and files that did not
+    change since then are left untouched. Every file is recorded in the
+    crawl ``journal`` once it is on disk. Bodies over the size limit of the
+    ``request_filter`` are not fetched from the browser at all, and assets
+    announced above ``STREAM_THRESHOLD`` are streamed to disk in chunks
+    by a second, page-side fetch; the responses that fetch causes, and
+    later responses for an asset already saved, are ignored. Cross-origin
+    assets the page may not read fall back to buffering.
+    HTML and CSS go to the ``raw_store`` when deferring the rewrite. Files
+    are written to ``sink``, loose files on disk by default. ``fanout``
+    nests them in hash folders (ab/cd/<hash>.ext).
+    """
+    streaming = set()  # Keys of the assets being streamed right now
+
+    async def handle_response(response):
+        try:
+            # Taken first, so the mark is also cleared for responses skipped below
+            from_cache = cache is not None and cache.take_served(response.url)
+            if request_filter and request_filter.too_large(response.url, response.headers, response.request.resource_type):
+                print(f"🚫 Skip (too large): {response.url}")
+                return
+            url = response.url
+            headers = response.headers
+            content_type = (headers.get("content-type") or "").lower()
             target_domain = urlparse(page.url).netloc
-            
-            
-            asset_type = "misc"  # Default folder for unrecognized types
-            
-            if "text/html" in content_type:
-                asset_type = "html"
-            elif "text/css" in content_type:
-                asset_type = "css"
-            elif "text/javascript" in content_type or "application/javascript" in content_type:
-                asset_type = "js"
-            elif "image/" in content_type:
-                asset_type = "images"
-            elif "font/" in content_type or "application/font" in content_type or ".woff" in response.url or ".ttf" in response.url:
-                asset_type = "fonts"
-            elif "video/" in content_type:
-                asset_type = "videos"
-            elif "audio/" in content_type:
-                asset_type = "audio"
-            elif "application/json" in content_type:
-                asset_type = "json"
-                
+            asset_type = asset_type_of(content_type, url)
             
             # Save assets in domain/assets/[asset_type] folder
-            local_rel_path = os.path.join(target_domain, "assets", asset_type, hash_path(response.url, content_type))
-            local_path = os.path.join(output_dir, local_rel_path)
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            asset_dir = os.path.join(output_dir, target_domain, "assets", asset_type)
+
+            streamed = None
+            announced = headers.get("content-length", "")
+            if asset_type not in ("html", "css") and announced.isdigit() and int(announced) > STREAM_THRESHOLD:
+                key = registry.key(url)
+                if key in streaming or url in registry:
+                    return  # Caused by our own stream fetch, or saved already
+                streaming.add(key)
+                try:
+                    streamed = await stream_response(page, url, asset_dir, content_type, sink, fanout)
+                finally:
+                    streaming.discard(key)
+
+            if streamed:
+                local_path, body_hash, size = streamed
+                body = None
+            else:
+                try:
+                    body = await response.body()
+                except Exception:
+                    print(f"⚠️ Normal fetch failed, falling back for: {url}")
+                    body = await fetch_fallback(page, url)
+                    if not body:
+                        print(f"❌ Cannot fetch: {url}")
+                        return
+                body_hash = content_hash(body)
+                size = len(body)
+                local_path = os.path.join(
+                    asset_dir, asset_file_name(url, content_type, asset_type, body_hash, fanout)
+                )
+
+            if on_saved:
+                on_saved(url, size)
             
             # Store in URL to local path mapping
-            url_to_local_path[response.url] = local_path
-
-            if "text/html" in content_type:
-                text_content = body.decode("utf-8", errors="ignore")
-                
-                # Save data URIs in domain/assets/asset_type/embedded folder
-                embedded_dir = os.path.join(os.path.dirname(local_path), "embedded")
-                text_content = extract_and_replace_data_uri(
-                    text_content,
-                    embedded_dir,
-                    f"{asset_type}_embedded"  # Prefix with asset type
-                )
-                
-                base_url = response.url
-                text_content = rewrite_html_links(text_content, base_url, os.path.dirname(local_path))
-                with open(local_path, "w", encoding="utf-8") as f:
-                    f.write(text_content)
-            elif "text/css" in content_type:
-                text_content = body.decode("utf-8", errors="ignore")
-                
-                embedded_dir = os.path.join(os.path.dirname(local_path), "embedded")
-                text_content = extract_and_replace_data_uri(
-                    text_content,
-                    embedded_dir,
-                    f"{asset_type}_embedded"  
-                )
-                
-                base_url = response.url
-                text_content = rewrite_css_urls(text_content, base_url, os.path.dirname(local_path))
-                with open(local_path, "w", encoding="utf-8") as f:
-                    f.write(text_content)
-            else:
-                with open(local_path, "wb") as f:
-                    f.write(body)
+            registry.register(url, local_path, {"hash": body_hash, "content_type": content_type})
+
+            # Responses fulfilled from the cache are already stored there
+            cacheable = not from_cache and response.status == 200 and response.request.method == "GET"
+            persist = make_persist(
+                url, headers, content_type, body, body_hash, local_path, asset_type, output_dir, registry,
+                cache=cache if cacheable else None,
+                previous=previous,
+                journal=journal,
+                written=bool(streamed),
+                raw_store=raw_store,
+                sink=sink
+            )
 
-            print(f"📥 Saved: {local_path}")
+            if writer:
+                await writer.submit(persist)
+            else:
+                persist()
 
         except Exception as e:
             print(f"⚠️ Error saving file: {e}")
             
     return handle_response
 
-async def handle_request(route, request):
-    """Handle requests and filter out unnecessary ones"""
-    url = request.url
-    
-    # Skip unnecessary files (manifest, tracking, ads)
-    skip_patterns = [
-        "manifest.json", 
-        "google-analytics.com", 
-        "analytics.", 
-        "tracker.", 
-        "tracking.", 
-        "adservice.", 
-        "pagead", 
-        "doubleclick.net"
-    ]
-    
-    for pattern in skip_patterns:
-        if pattern in url:
-            print(f"🚫 Skip: {url}")
+
+async def fulfill_from_cache(route, cache, entry):
+    """Answer a request with a body and headers stored in the capture cache"""
+    body = await asyncio.to_thread(cache.read_body, entry)
+    headers = dict(entry["headers"])
+    if not any(name.lower() == "content-type" for name in headers):
+        headers["content-type"] = entry["content_type"] or "application/octet-stream"
+    cache.mark_served(route.request.url)
+    await route.fulfill(status=200, headers=headers, body=body)
+
+
+def create_request_handler(cache=None, request_filter=None):
+    """Create handler for requests
+
+    Requests rejected by the ``RequestFilter`` (by default the built-in
+    tracking and ads patterns) are aborted. Without a cache every other
+    request goes to the network.
+    With a ``CaptureCache``, fresh entries are served from disk and stale
+    ones are revalidated with If-None-Match / If-Modified-Since; stale
+    entries without validators go to the network as usual.
+    """
+    if request_filter is None:
+        request_filter = RequestFilter()
+
+    async def handle_request(route, request):
+        """Handle requests and filter out unnecessary ones"""
+        url = request.url
+        
+        # Skip unnecessary files (manifest, tracking, ads, blocked types)
+        reason = request_filter.check(url, request.resource_type)
+        if reason:
+            print(f"🚫 Skip ({reason}): {url}")
             await route.abort()  # Don't fetch
             return
-            
-    # Continue for all other resources
-    await route.continue_()
+
+        entry = cache.lookup(url) if cache and request.method == "GET" else None
+        if entry is None:
+            # Continue for all other resources
+            await route.continue_()
+            return
+
+        if entry["expires"] > time.time():
+            print(f"💾 Cache hit: {url}")
+            await fulfill_from_cache(route, cache, entry)
+            return
+
+        if not entry["etag"] and not entry["last_modified"]:
+            # Nothing to revalidate with, the response handler stores the new copy
+            await route.continue_()
+            return
+
+        headers = dict(request.headers)
+        if entry["etag"]:
+            headers["if-none-match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["if-modified-since"] = entry["last_modified"]
+        try:
+            response = await route.fetch(headers=headers)
+        except Exception as e:
+            print(f"⚠️ Revalidation failed, serving cached copy of {url}: {e}")
+            await fulfill_from_cache(route, cache, entry)
+            return
+
+        if response.status == 304:
+            print(f"💾 Not modified: {url}")
+            cache.refresh(url, response.headers)
+            await fulfill_from_cache(route, cache, entry)
+        else:
+            await route.fulfill(response=response)
+
+    return handle_request
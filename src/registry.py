@@ -0,0 +1,193 @@
+import os
+import json
+import sqlite3
+import threading
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Query parameters that only track the visitor and never change the resource
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "yclid", "dclid", "mc_cid", "mc_eid", "_ga", "_gl", "igshid"}
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+
+@lru_cache(maxsize=65536)
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL used as registry key
+
+    Lowercases scheme and host, drops default ports, fragments and
+    tracking parameters (utm_*, gclid, ...). The order of the remaining
+    query parameters is kept.
+    """
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    host, _, port = netloc.rpartition(":")
+    if host and DEFAULT_PORTS.get(scheme) == port:
+        netloc = host
+    path = parts.path or "/"
+
+    query = parts.query
+    if query:
+        params = parse_qsl(query, keep_blank_values=True)
+        kept = [(k, v) for k, v in params if not (k.lower().startswith("utm_") or k.lower() in TRACKING_PARAMS)]
+        if len(kept) != len(params):
+            query = urlencode(kept)
+
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+class UrlRegistry:
+    """Mapping of captured URLs to local files for one clone
+
+    Keys are normalized URLs, so equivalent URLs (fragments, tracking
+    parameters, default ports) resolve to the same file. Each entry also
+    carries its manifest data (content hash, type, rewritten links). Safe
+    to use from the event loop and the writer threads.
+
+    With a ``db_path``, entries beyond ``memory_limit`` are spilled to an
+    SQLite file so huge crawls keep a bounded memory footprint. A limit of
+    0 writes every entry straight through, which lets several processes
+    share one registry.
+    """
+
+    def __init__(self, db_path=None, memory_limit=None):
+        self.db_path = db_path
+        self.memory_limit = memory_limit
+        self.missing = set()
+        # Missing URL → folders of the documents referencing it
+        self._missing_sources = {}
+        # Keys of documents left as they were by an incremental run
+        self.unchanged = set()
+        self._paths = {}
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._conn = None
+        if db_path and memory_limit == 0:
+            self._connect()
+
+    key = staticmethod(normalize_url)
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS registry (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                entry TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def register(self, url, local_path, entry=None):
+        """Map a URL to the local file it is saved in"""
+        key = self.key(url)
+        with self._lock:
+            self._paths[key] = local_path
+            self._entries[key] = dict(entry or {})
+            if self.db_path and self.memory_limit is not None and len(self._paths) > self.memory_limit:
+                self._spill()
+
+    def update_entry(self, url, **fields):
+        """Add manifest data to a registered URL"""
+        key = self.key(url)
+        with self._lock:
+            if key in self._entries:
+                self._entries[key].update(fields)
+                return
+            row = self._select(key)
+            if row:
+                entry = json.loads(row[1])
+                entry.update(fields)
+                with self._conn:
+                    self._conn.execute("UPDATE registry SET entry = ? WHERE key = ?", (json.dumps(entry), key))
+
+    def get(self, url, default=None):
+        """Local file of a URL, or ``default`` if it was not captured"""
+        key = self.key(url)
+        with self._lock:
+            local_path = self._paths.get(key)
+            if local_path is not None:
+                return local_path
+            row = self._select(key)
+        return row[0] if row else default
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def items(self):
+        """Yield (key, local path, entry) of every registered URL"""
+        with self._lock:
+            rows = [(key, path, dict(self._entries.get(key, {}))) for key, path in self._paths.items()]
+            if self._conn is not None:
+                rows.extend(
+                    (key, path, json.loads(entry))
+                    for key, path, entry in self._conn.execute("SELECT key, path, entry FROM registry")
+                    if key not in self._paths
+                )
+        return iter(rows)
+
+    def snapshot(self):
+        """Plain dict of key → local path, e.g. to hand to other processes"""
+        return {key: path for key, path, _ in self.items()}
+
+    def add_missing(self, urls, local_path):
+        """Record URLs referenced by the file at ``local_path`` that were not captured"""
+        folder = os.path.dirname(local_path)
+        with self._lock:
+            self.missing.update(urls)
+            for url in urls:
+                self._missing_sources.setdefault(url, set()).add(folder)
+
+    def not_captured(self, under=None):
+        """URLs referenced by rewritten files that were never captured
+
+        With ``under``, only URLs referenced by files in that folder or
+        below, e.g. the folder of one site in a batch.
+        """
+        # Copy first, writer threads may add to the set meanwhile
+        with self._lock:
+            missing = set(self.missing)
+            if under is not None:
+                prefix = os.path.join(os.path.abspath(under), "")
+                missing = {
+                    url for url in missing
+                    if any(os.path.join(os.path.abspath(folder), "").startswith(prefix)
+                           for folder in self._missing_sources.get(url, ()))
+                }
+        return {url for url in missing if url not in self}
+
+    def _select(self, key):
+        if self._conn is None:
+            return None
+        return self._conn.execute("SELECT path, entry FROM registry WHERE key = ?", (key,)).fetchone()
+
+    def _spill(self):
+        if self._conn is None:
+            self._connect()
+            if self.memory_limit:
+                # A private spill file never outlives its clone
+                with self._conn:
+                    self._conn.execute("DELETE FROM registry")
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO registry (key, path, entry) VALUES (?, ?, ?)",
+                [(key, path, json.dumps(self._entries.get(key, {}))) for key, path in self._paths.items()]
+            )
+        self._paths.clear()
+        self._entries.clear()
+
+    def close(self, remove=False):
+        """Close the spill file, deleting it when ``remove`` is set"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            if remove and self.db_path:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(self.db_path + suffix):
+                        os.remove(self.db_path + suffix)
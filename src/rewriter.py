@@ -1,73 +1,270 @@
 import os
 import re
+import html
+from functools import lru_cache
 from urllib.parse import urljoin
-from bs4 import BeautifulSoup
-from .utils import url_to_local_path
 
-def convert_url_to_local(url, base_url, base_dir):
-    """Convert URL to local path based on existing mapping"""
-    if not url or url.startswith("data:") or url.startswith("javascript:"):
+# Entries kept by the memoized URL and path resolvers
+RESOLVER_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=RESOLVER_CACHE_SIZE)
+def resolve_url(base_url, url):
+    """Memoized urljoin; pages of one site repeat the same links over and over"""
+    return urljoin(base_url, url)
+
+
+@lru_cache(maxsize=4096)
+def _path_parts(directory):
+    return tuple(part for part in os.path.abspath(directory).split(os.sep) if part)
+
+
+@lru_cache(maxsize=RESOLVER_CACHE_SIZE)
+def _relative_dir(target_dir, base_dir):
+    target = _path_parts(target_dir)
+    base = _path_parts(base_dir)
+    common = 0
+    for target_part, base_part in zip(target, base):
+        if target_part != base_part:
+            break
+        common += 1
+    return [".."] * (len(base) - common) + list(target[common:])
+
+
+def relative_path(local_path, base_dir):
+    """Path of ``local_path`` relative to ``base_dir`` with forward slashes
+
+    Same result as os.path.relpath, but the walk between two directories
+    is computed once per directory pair instead of once per link.
+    """
+    target_dir, name = os.path.split(local_path)
+    return "/".join(_relative_dir(target_dir, base_dir) + [name])
+
+
+def convert_url_to_local(url, base_url, base_dir, registry, resolved=None, missing=None):
+    """Convert URL to local path based on the mapping of a UrlRegistry
+
+    Every URL that was rewritten is recorded in the ``resolved`` dict
+    (registry key → local path) when one is given, and every http(s) URL
+    that has not been downloaded is added to the ``missing`` set.
+    Fragment-only links (``#top``) point into the document itself and are
+    left alone; other fragments are kept on the local path.
+    """
+    if not url or url.startswith(("data:", "javascript:", "#")):
         return url
     
     # Convert relative URL to absolute
-    absolute_url = urljoin(base_url, url)
+    absolute_url = resolve_url(base_url, url)
     
     # Check if this URL has been downloaded already
-    if absolute_url in url_to_local_path:
-        local_path = url_to_local_path[absolute_url]
-        # Return path relative to base_dir
-        rel_path = os.path.relpath(local_path, base_dir)
-        return rel_path.replace('\\', '/')
+    local_path = registry.get(absolute_url)
+    if local_path is not None:
+        if resolved is not None:
+            resolved[registry.key(absolute_url)] = local_path
+        # Return path relative to base_dir, with the fragment the registry key drops
+        _, hash_sign, fragment = url.partition("#")
+        return relative_path(local_path, base_dir) + hash_sign + fragment
     
+    if missing is not None and absolute_url.startswith(("http://", "https://")):
+        missing.add(registry.key(absolute_url))
     return url  # If not downloaded, keep original URL
 
-def rewrite_html_links(html_content, base_url, base_dir):
-    """Change all links in HTML to local paths"""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    
-    for a_tag in soup.find_all('a', href=True):
-        a_tag['href'] = convert_url_to_local(a_tag['href'], base_url, base_dir)
-    
-    for img_tag in soup.find_all('img', src=True):
-        img_tag['src'] = convert_url_to_local(img_tag['src'], base_url, base_dir)
-    
-    for link_tag in soup.find_all('link', href=True):
-        link_tag['href'] = convert_url_to_local(link_tag['href'], base_url, base_dir)
-    
-    for script_tag in soup.find_all('script', src=True):
-        script_tag['src'] = convert_url_to_local(script_tag['src'], base_url, base_dir)
-    
-    for iframe_tag in soup.find_all('iframe', src=True):
-        iframe_tag['src'] = convert_url_to_local(iframe_tag['src'], base_url, base_dir)
-    
-    for img_tag in soup.find_all('img', srcset=True):
-        srcset = img_tag['srcset']
-        parts = srcset.split(',')
-        new_srcset_parts = []
-        
-        for part in parts:
-            url_width = part.strip().split(' ')
-            if len(url_width) >= 1:
-                url = url_width[0]
-                local_url = convert_url_to_local(url, base_url, base_dir)
-                new_part = local_url + ' ' + ' '.join(url_width[1:])
-                new_srcset_parts.append(new_part)
-        
-        img_tag['srcset'] = ', '.join(new_srcset_parts)
-    
-    return str(soup)
+# Attributes that hold links, per tag
+LINK_ATTRIBUTES = {
+    "a": ("href",),
+    "img": ("src", "srcset"),
+    "link": ("href",),
+    "script": ("src",),
+    "iframe": ("src",),
+}
+# <link> relations whose target is an asset worth fetching when it was never loaded
+FETCHABLE_LINK_REGEX = re.compile(
+    r"""\brel\s*=\s*["']?[^"'>]*\b(?:stylesheet|icon|preload|modulepreload)\b""", re.I
+)
+# Elements whose content is raw text and must not be scanned for tags
+RAW_TEXT_END = {
+    "script": re.compile(r"</script\s*>", re.I),
+    "style": re.compile(r"</style\s*>", re.I),
+}
+TAG_REGEX = re.compile(
+    r"<!--.*?-->|<(?P<name>[a-zA-Z][^\s/>]*)(?P<attrs>(?:[^>\"']|\"[^\"]*\"|'[^']*')*)>",
+    re.S
+)
+ATTR_REGEX = re.compile(
+    r"(?P<name>[^\s\"'>/=]+)(?P<eq>\s*=\s*)(?:\"(?P<dq>[^\"]*)\"|'(?P<sq>[^']*)'|(?P<uq>[^\s\"'=<>`]+))"
+)
+
+
+def rewrite_srcset(srcset, base_url, base_dir, registry, resolved=None, missing=None):
+    """Change every candidate URL of a srcset attribute to a local path"""
+    new_srcset_parts = []
+    changed = False
+    for part in srcset.split(','):
+        url_width = part.strip().split(' ')
+        url = url_width[0]
+        local_url = convert_url_to_local(url, base_url, base_dir, registry, resolved, missing)
+        changed = changed or local_url != url
+        new_srcset_parts.append(local_url + ' ' + ' '.join(url_width[1:]))
+    if not changed:
+        return srcset
+    return ', '.join(new_srcset_parts)
+
+
+def rewrite_tag_attributes(attrs, link_attributes, base_url, base_dir, registry, resolved=None, missing=None):
+    """Rewrite link attributes inside the raw attribute text of one tag"""
+    def replace_attr(match):
+        name = match.group("name").lower()
+        if name not in link_attributes:
+            return match.group(0)
+
+        raw_value = match.group("dq")
+        quote = '"'
+        if raw_value is None:
+            raw_value = match.group("sq")
+            quote = "'"
+        if raw_value is None:
+            raw_value = match.group("uq")
+            quote = ""
+
+        value = html.unescape(raw_value)
+        if name == "srcset":
+            new_value = rewrite_srcset(value, base_url, base_dir, registry, resolved, missing)
+        else:
+            new_value = convert_url_to_local(value, base_url, base_dir, registry, resolved, missing)
+        if new_value == value:
+            return match.group(0)
+
+        new_value = html.escape(new_value, quote=True)
+        if not quote and any(c.isspace() for c in new_value):
+            quote = '"'
+        return f"{match.group('name')}{match.group('eq')}{quote}{new_value}{quote}"
+
+    return ATTR_REGEX.sub(replace_attr, attrs)
+
+
+def rewrite_html_links(html_content, base_url, base_dir, registry, resolved=None, missing=None, unresolved=None):
+    """Change all links in HTML to local paths
+
+    Single pass over the tags of the document: link attributes are
+    rewritten in place and everything else is copied verbatim, so the
+    original formatting is preserved. Assets of <img>, <script> and
+    stylesheet/icon/preload <link> tags that were not downloaded (e.g.
+    unused srcset candidates or lazy images) are added to ``missing``;
+    pages behind <a> and <iframe> are not assets and never are. Every
+    http(s) link left remote, pages included, is added to ``unresolved``.
+    """
+    output = []
+    pos = 0
+    length = len(html_content)
+
+    while pos < length:
+        match = TAG_REGEX.search(html_content, pos)
+        if not match:
+            break
+
+        name = match.group("name")
+        if name is None:
+            # Comment, copied as is
+            output.append(html_content[pos:match.end()])
+            pos = match.end()
+            continue
+
+        name = name.lower()
+        output.append(html_content[pos:match.start()])
+        link_attributes = LINK_ATTRIBUTES.get(name)
+        if link_attributes:
+            fetchable = name in ("img", "script") or (
+                name == "link" and FETCHABLE_LINK_REGEX.search(match.group("attrs"))
+            )
+            found = set() if missing is not None or unresolved is not None else None
+            attrs = rewrite_tag_attributes(
+                match.group("attrs"), link_attributes, base_url, base_dir, registry, resolved, found
+            )
+            if found:
+                if unresolved is not None:
+                    unresolved.update(found)
+                if fetchable and missing is not None:
+                    missing.update(found)
+            output.append(f"<{match.group('name')}{attrs}>")
+        else:
+            output.append(match.group(0))
+        pos = match.end()
+
+        end_regex = RAW_TEXT_END.get(name)
+        if end_regex:
+            end_match = end_regex.search(html_content, pos)
+            raw_end = end_match.start() if end_match else length
+            output.append(html_content[pos:raw_end])
+            pos = raw_end
+
+    output.append(html_content[pos:])
+    return "".join(output)
+
+CSS_STRING = r"""(?:"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')"""
+CSS_URL_REGEX = re.compile(
+    r"""/\*.*?\*/"""
+    r"""|(?P<url>url\(\s*)(?:"(?P<url_dq>(?:[^"\\\n]|\\.)*)"|'(?P<url_sq>(?:[^'\\\n]|\\.)*)'|(?P<url_uq>[^)"'\s]*))\s*\)"""
+    r"""|(?P<import>@import\s+)(?:"(?P<import_dq>(?:[^"\\\n]|\\.)*)"|'(?P<import_sq>(?:[^'\\\n]|\\.)*)')"""
+    r"""|(?P<image_set>(?:-webkit-)?image-set\()(?P<image_set_body>(?:[^()"']|""" + CSS_STRING + r"""|\([^()]*\))*)\)""",
+    re.I | re.S
+)
+CSS_STRING_REGEX = re.compile(
+    r"""url\([^)]*\)|"(?P<dq>(?:[^"\\\n]|\\.)*)"|'(?P<sq>(?:[^'\\\n]|\\.)*)'""",
+    re.I
+)
+CSS_CHUNK_SIZE = 1 << 20
+
+
+def rewrite_css_urls(css_content, base_url, base_dir, registry, resolved=None, missing=None):
+    """Change all URLs in CSS to local paths
+
+    Handles url() with any quoting, @import strings and the bare strings
+    of image-set() in one pass; comments are left alone. URLs that were
+    not downloaded are added to ``missing`` when a set is given.
+    """
+    def convert(url):
+        return convert_url_to_local(url, base_url, base_dir, registry, resolved, missing)
+
+    def replace_image_set_string(match):
+        if match.group("dq") is not None:
+            return f'"{convert(match.group("dq"))}"'
+        if match.group("sq") is not None:
+            return f"'{convert(match.group('sq'))}'"
+        return CSS_URL_REGEX.sub(replace_url, match.group(0))
 
-def rewrite_css_urls(css_content, base_url, base_dir):
-    """Change all URLs in CSS to local paths"""
-    url_pattern = re.compile(r'url\([\'"]?(.*?)[\'"]?\)')
-    
     def replace_url(match):
-        url = match.group(1)
-        if url.startswith('data:'):
-            return f'url({url})'
-        
-        local_url = convert_url_to_local(url, base_url, base_dir)
-        return f'url({local_url})'
-    
-    return url_pattern.sub(replace_url, css_content)
+        if match.group("url"):
+            for group, quote in (("url_dq", '"'), ("url_sq", "'"), ("url_uq", "")):
+                url = match.group(group)
+                if url is not None:
+                    return f"url({quote}{convert(url.strip())}{quote})"
+        if match.group("import"):
+            for group, quote in (("import_dq", '"'), ("import_sq", "'")):
+                url = match.group(group)
+                if url is not None:
+                    return f"{match.group('import')}{quote}{convert(url)}{quote}"
+        if match.group("image_set"):
+            body = CSS_STRING_REGEX.sub(replace_image_set_string, match.group("image_set_body"))
+            return f"{match.group('image_set')}{body})"
+        return match.group(0)
+
+    return CSS_URL_REGEX.sub(replace_url, css_content)
+
+
+def rewrite_css_stream(chunks, base_url, base_dir, registry, resolved=None, missing=None):
+    """Rewrite a large stylesheet given as an iterable of text chunks
+
+    Yields rewritten chunks. Input is only cut after a closing brace, so
+    no url(), @import or image-set() is ever split between two chunks.
+    """
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        cut = buffer.rfind("}") + 1
+        if cut == 0 and len(buffer) > 4 * CSS_CHUNK_SIZE:
+            cut = buffer.rfind(";") + 1
+        if cut > 0:
+            yield rewrite_css_urls(buffer[:cut], base_url, base_dir, registry, resolved, missing)
+            buffer = buffer[cut:]
+    if buffer:
+        yield rewrite_css_urls(buffer, base_url, base_dir, registry, resolved, missing)
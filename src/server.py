@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Static file server for cloned mirrors
+
+Serves one folder with asyncio: keep-alive connections, file bodies sent
+with sendfile, single Range requests, ETag / Last-Modified revalidation,
+precompressed ``.br`` / ``.gz`` siblings and the Content-Type captured in
+manifest.json. Only the standard library is used, so this file is copied
+as-is next to every cloned site.
+
+Usage:
+  python3 server.py                  # serve the folder of this file on port 8000
+  python3 server.py 8080 --root output/example.com --host 127.0.0.1
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote, urlsplit
+
+MANIFEST_NAME = "manifest.json"
+MAX_HEADER_SIZE = 64 * 1024
+KEEP_ALIVE_TIMEOUT = 15
+# Content-Encoding of precompressed siblings, in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+REASONS = {
+    200: "OK", 206: "Partial Content", 301: "Moved Permanently", 304: "Not Modified",
+    400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+    416: "Range Not Satisfiable", 431: "Request Header Fields Too Large", 500: "Internal Server Error"
+}
+
+
+def load_content_types(root):
+    """Absolute file path → captured Content-Type, from the nearest manifest.json
+
+    The manifest lives in the output folder, one level above the site
+    folder, and its paths are relative to that folder.
+    """
+    for directory in (root, os.path.dirname(root)):
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if not os.path.isfile(manifest_path):
+            continue
+        try:
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Manifest not readable, guessing MIME types: {e}")
+            return {}
+        types = {}
+        for entry in manifest.values():
+            if entry.get("content_type") and entry.get("path"):
+                types[os.path.normpath(os.path.join(directory, entry["path"]))] = entry["content_type"]
+        return types
+    return {}
+
+
+def parse_range(value, size):
+    """(start, end) of a ``bytes=`` range, None to send everything, or False if unsatisfiable
+
+    Only single ranges are served; a multi-range request gets the full body.
+    """
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+class StaticServer:
+    """Serves the files below ``root`` over HTTP/1.1"""
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.content_types = load_content_types(self.root)
+        self._date = (0, "")
+
+    def http_date(self):
+        now = int(time.time())
+        if self._date[0] != now:
+            self._date = (now, formatdate(now, usegmt=True))
+        return self._date[1]
+
+    def content_type(self, path):
+        content_type = self.content_types.get(path)
+        if not content_type:
+            content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+                content_type += "; charset=utf-8"
+        return content_type
+
+    def resolve(self, target):
+        """File path of a request target, or an HTTP status if there is none"""
+        path = unquote(urlsplit(target).path)
+        if "\0" in path:
+            return 400
+        full_path = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+        if full_path != self.root and not full_path.startswith(self.root + os.sep):
+            return 403
+        if os.path.isdir(full_path):
+            if not path.endswith("/"):
+                return 301
+            full_path = os.path.join(full_path, "index.html")
+        if not os.path.isfile(full_path):
+            return 404
+        return full_path
+
+    def select_encoding(self, path, accept_encoding):
+        """Precompressed sibling accepted by the client, as (path, encoding)"""
+        accepted = {item.split(";")[0].strip().lower() for item in accept_encoding.split(",")}
+        for encoding, suffix in ENCODINGS:
+            if encoding in accepted and os.path.isfile(path + suffix):
+                return path + suffix, encoding
+        return path, None
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    await self.send_error(writer, 431, False)
+                    return
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    await self.send_error(writer, 400, False)
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get("connection", "").lower()
+                if version == "HTTP/1.1":
+                    keep_alive = connection != "close"
+                else:
+                    keep_alive = connection == "keep-alive"
+                if "content-length" in headers or "transfer-encoding" in headers:
+                    keep_alive = False  # Request bodies are not read
+
+                if method not in ("GET", "HEAD"):
+                    await self.send_error(writer, 405, keep_alive, {"Allow": "GET, HEAD"})
+                elif not await self.send_file(loop, writer, method, target, headers, keep_alive):
+                    keep_alive = False
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Error serving request: {e}")
+        finally:
+            writer.close()
+
+    async def send_head(self, writer, status, headers, keep_alive):
+        lines = [f"HTTP/1.1 {status} {REASONS[status]}", f"Date: {self.http_date()}", "Server: clonner"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+    async def send_error(self, writer, status, keep_alive, headers=None):
+        body = f"{status} {REASONS[status]}\n".encode()
+        headers = {"Content-Type": "text/plain; charset=utf-8", "Content-Length": len(body), **(headers or {})}
+        await self.send_head(writer, status, headers, keep_alive)
+        writer.write(body)
+        await writer.drain()
+
+    async def send_file(self, loop, writer, method, target, request_headers, keep_alive):
+        """Answer one GET or HEAD, return False if the connection must be closed"""
+        path = self.resolve(target)
+        if path == 301:
+            location = urlsplit(target)._replace(path=urlsplit(target).path + "/").geturl()
+            await self.send_error(writer, 301, keep_alive, {"Location": location})
+            return True
+        if isinstance(path, int):
+            await self.send_error(writer, path, keep_alive)
+            return True
+
+        file_path, encoding = self.select_encoding(path, request_headers.get("accept-encoding", ""))
+        stat = os.stat(file_path)
+        size = stat.st_size
+        etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        headers = {
+            "Content-Type": self.content_type(path),
+            "ETag": etag,
+            "Last-Modified": last_modified,
+            "Accept-Ranges": "bytes",
+        }
+        if os.path.isfile(path + ".br") or os.path.isfile(path + ".gz"):
+            headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            headers["Content-Encoding"] = encoding
+
+        if self.not_modified(request_headers, etag, stat.st_mtime):
+            await self.send_head(writer, 304, headers, keep_alive)
+            return True
+
+        status, start, length = 200, 0, size
+        byte_range = request_headers.get("range")
+        if byte_range and request_headers.get("if-range", etag) in (etag, last_modified):
+            span = parse_range(byte_range, size)
+            if span is False:
+                await self.send_error(writer, 416, keep_alive, {"Content-Range": f"bytes */{size}"})
+                return True
+            if span:
+                status, start, length = 206, span[0], span[1] - span[0] + 1
+                headers["Content-Range"] = f"bytes {span[0]}-{span[1]}/{size}"
+        headers["Content-Length"] = length
+
+        await self.send_head(writer, status, headers, keep_alive)
+        if method == "HEAD" or not length:
+            return True
+        with open(file_path, "rb") as f:
+            sent = await loop.sendfile(writer.transport, f, start, length)
+        return sent == length
+
+    def not_modified(self, request_headers, etag, mtime):
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return etag in tags or "*" in tags
+        if_modified_since = request_headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+async def serve(root, host="0.0.0.0", port=8000):
+    server = StaticServer(root)
+    listener = await asyncio.start_server(server.handle, host, port, limit=MAX_HEADER_SIZE, reuse_address=True)
+    print(f"🌐 Serving {server.root} at http://{host}:{port}/ ({len(server.content_types)} MIME types from manifest)")
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a cloned site.")
+    parser.add_argument("port",
+                        nargs="?",
+                        type=int,
+                        default=8000,
+                        help="Port to listen on. Default: 8000")
+    parser.add_argument("--host",
+                        default="0.0.0.0",
+                        help="Address to listen on. Default: 0.0.0.0 (all interfaces)")
+    parser.add_argument("--root",
+                        default=os.path.dirname(os.path.abspath(__file__)),
+                        help="Folder to serve. Default: the folder of this file")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.root, args.host, args.port))
+    except KeyboardInterrupt:
+        sys.exit(0)
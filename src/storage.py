@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import threading
+import warnings
+import zipfile
+from contextlib import contextmanager
+
+from .utils import write_blob
+
+ARCHIVE_NAME = "mirror.zip"
+# Already compressed formats are stored as they are in archives
+STORED_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".ico", ".woff", ".woff2", ".mp4", ".webm",
+    ".mp3", ".ogg", ".m4a", ".zip", ".gz", ".br", ".pdf"
+}
+
+
+class DirectorySink:
+    """Writes every file at its own path on disk (the default)"""
+
+    def temp_dir(self, path):
+        """Folder for temporary files that end up at ``path``"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    @contextmanager
+    def open(self, path):
+        """Binary file object that replaces ``path``"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            yield f
+
+    def write_once(self, path, data):
+        """Write a content-addressed file, return False if it already existed"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return write_blob(path, data)
+
+    def move_in(self, path, source):
+        """Move a finished temporary file to a content-addressed path"""
+        if os.path.exists(path):
+            os.remove(source)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source, path)
+        return True
+
+    def close(self):
+        pass
+
+
+LOCAL_FILES = DirectorySink()
+
+
+class ZipSink:
+    """Appends every file to one ZIP archive instead of loose files
+
+    Entries are named after their path relative to ``output_dir``, so the
+    links rewritten between them stay valid inside the archive, and the
+    central directory of the ZIP is a random-access index of the mirror.
+    Writes from several threads are serialized. A file written twice
+    (e.g. a page rewritten again) is appended again; readers use the last
+    entry.
+    """
+
+    def __init__(self, output_dir, archive_path=None):
+        self.output_dir = output_dir
+        self.archive_path = archive_path or os.path.join(output_dir, ARCHIVE_NAME)
+        os.makedirs(os.path.dirname(self.archive_path) or ".", exist_ok=True)
+        self._zip = zipfile.ZipFile(self.archive_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._names = set()
+        self._lock = threading.Lock()
+        self._scratch = tempfile.mkdtemp(prefix=".stream-", dir=output_dir)
+
+    def name(self, path):
+        return os.path.relpath(path, self.output_dir).replace("\\", "/")
+
+    def _info(self, name):
+        info = zipfile.ZipInfo(name)
+        if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+            info.compress_type = zipfile.ZIP_STORED
+        else:
+            info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        return info
+
+    def _append(self, name, source):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # Duplicate names are intended
+            with self._zip.open(self._info(name), "w", force_zip64=True) as out:
+                shutil.copyfileobj(source, out, 1 << 20)
+        self._names.add(name)
+
+    def temp_dir(self, path):
+        return self._scratch
+
+    @contextmanager
+    def open(self, path):
+        # Spooled so the archive lock is only held while copying the result
+        with tempfile.SpooledTemporaryFile(max_size=8 << 20, dir=self._scratch) as buffer:
+            yield buffer
+            buffer.seek(0)
+            with self._lock:
+                self._append(self.name(path), buffer)
+
+    def write_once(self, path, data):
+        name = self.name(path)
+        with self._lock:
+            if name in self._names:
+                return False
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                self._zip.writestr(self._info(name), data)
+            self._names.add(name)
+        return True
+
+    def move_in(self, path, source):
+        name = self.name(path)
+        try:
+            with self._lock:
+                if name in self._names:
+                    return False
+                with open(source, "rb") as f:
+                    self._append(name, f)
+            return True
+        finally:
+            os.remove(source)
+
+    def close(self):
+        """Write the central directory; the archive is unreadable before"""
+        with self._lock:
+            self._zip.close()
+        shutil.rmtree(self._scratch, ignore_errors=True)
@@ -1,13 +1,16 @@
 import os
 import re
+import sys
 import mimetypes
 import hashlib
 import base64
+import json
+import shutil
+import threading
 import filetype
 from urllib.parse import urlparse
 
-# Global mapping to track original URLs to local paths
-url_to_local_path = {}
+MANIFEST_NAME = "manifest.json"
 DATA_URI_REGEX = re.compile(r'data:([a-zA-Z0-9/+\-.]+);base64,([a-zA-Z0-9+/=]+)')
 
 
@@ -17,6 +20,72 @@ def hash_path(url: str, content_type: str) -> str:
     h = hashlib.sha1(url.encode()).hexdigest()
     return f"{h}{ext}"
 
+def content_hash(data: bytes) -> str:
+    """Hash of a response body, used to deduplicate identical assets"""
+    return hashlib.sha1(data).hexdigest()
+
+def blob_name(body_hash: str, content_type: str) -> str:
+    """Filename of a content-addressed file from its hash and content type"""
+    ext = mimetypes.guess_extension(content_type.split(";")[0]) or ".bin"
+    return f"{body_hash}{ext}"
+
+def fanout_path(file_name: str, levels: int = 2) -> str:
+    """Spread hash-named files over nested folders, e.g. ab/cd/abcd1234.png
+
+    Keeps every folder small (256 entries per level) for huge mirrors.
+    """
+    parts = [file_name[i * 2:i * 2 + 2] for i in range(levels)]
+    return os.path.join(*parts, file_name)
+
+def write_blob(path: str, data: bytes) -> bool:
+    """Write a content-addressed file once, return False if it already existed"""
+    if os.path.exists(path):
+        return False
+    tmp_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
+
+def copy_blob(source: str, path: str) -> bool:
+    """Copy a file into a content-addressed path once, without buffering it"""
+    if os.path.exists(path):
+        return False
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, path)
+    return True
+
+def save_manifest(output_dir: str, registry, previous: dict = None, name: str = MANIFEST_NAME) -> str:
+    """Save the URL → local file mapping of a UrlRegistry with content hashes
+
+    Entries of a ``previous`` manifest that were not captured again are
+    kept, so an incremental run never forgets files it did not revisit.
+    """
+    def rel(path):
+        return os.path.relpath(path, output_dir).replace("\\", "/")
+
+    manifest = dict(previous or {})
+    for url, local_path, registry_entry in registry.items():
+        entry = {"path": rel(local_path)}
+        entry.update(registry_entry)
+        if "links" in entry:
+            entry["links"] = {link: rel(path) for link, path in entry["links"].items()}
+        manifest[url] = entry
+
+    manifest_path = os.path.join(output_dir, name)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest_path
+
+def load_manifest(output_dir: str, name: str = MANIFEST_NAME) -> dict:
+    """Load a manifest saved by save_manifest, or an empty one"""
+    manifest_path = os.path.join(output_dir, name)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
 def mkdir(path):
     """Create directory if it doesn't exist"""
     os.makedirs(path, exist_ok=True)
@@ -53,28 +122,73 @@ def parse_timeout(value: str) -> int:
     else:
         return int(value) * 1000
 
-def extract_and_replace_data_uri(content: str, base_dir: str, prefix="embedded") -> str:
-    """Extract data URIs into separate files and replace with relative paths"""
-    os.makedirs(base_dir, exist_ok=True)
-    matches = list(DATA_URI_REGEX.finditer(content))
-
-    for i, match in enumerate(matches, start=1):
+def parse_size(value: str) -> int:
+    """Parse size string (e.g., '500KB', '2GB') into bytes"""
+    value = str(value).upper().strip().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+def read_url_list(path: str) -> list:
+    """Read URLs from a file (one per line, '#' comment lines), or stdin when path is '-'"""
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+
+    urls = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#") and line not in urls:
+            urls.append(line)
+    return urls
+
+def extract_and_replace_data_uri(content: str, base_dir: str, prefix="embedded", relative_to=None, sink=None) -> str:
+    """Extract data URIs into separate files and replace with relative paths
+
+    Single pass: every match is decoded and written as soon as it is found.
+    Files are named after the hash of their bytes, so identical payloads are
+    stored once. Replacements are relative to ``relative_to`` (the folder of
+    the document) or bare file names when it is not given. Files go to
+    ``sink`` when one is given (see src/storage.py), else straight to disk.
+    """
+    written = set()
+
+    def replace(match):
         mime_type = match.group(1)
         data_b64 = match.group(2)
-        ext = mimetypes.guess_extension(mime_type) or ".bin"
-
-        file_name = f"{prefix}_{i}{ext}"
-        file_path = os.path.join(base_dir, file_name)
-
         try:
-            with open(file_path, "wb") as f:
-                f.write(base64.b64decode(data_b64))
-            print(f"📦 Extracted embedded data URI → {file_path}")
-            content = content.replace(match.group(0), file_name)
+            data = base64.b64decode(data_b64)
         except Exception as e:
             print(f"⚠️ Error extracting base64: {e}")
+            return match.group(0)
+
+        ext = mimetypes.guess_extension(mime_type) or ".bin"
+        file_name = f"{prefix}_{content_hash(data)[:16]}{ext}"
+        file_path = os.path.join(base_dir, file_name)
 
-    return content
+        if file_name not in written:
+            try:
+                if sink is not None:
+                    created = sink.write_once(file_path, data)
+                else:
+                    if not written:
+                        os.makedirs(base_dir, exist_ok=True)
+                    created = write_blob(file_path, data)
+                if created:
+                    print(f"📦 Extracted embedded data URI → {file_path}")
+                written.add(file_name)
+            except Exception as e:
+                print(f"⚠️ Error extracting base64: {e}")
+                return match.group(0)
+
+        if relative_to is None:
+            return file_name
+        return os.path.relpath(file_path, relative_to).replace("\\", "/")
+
+    return DATA_URI_REGEX.sub(replace, content)
 
 
 def detect_extension(url: str, content_type: str, data: bytes) -> str:
@@ -0,0 +1,60 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ResponseWriter:
+    """Persist captured responses in background threads
+
+    The capture callbacks only enqueue work; a few consumer tasks hand each
+    job to a thread pool so rewriting, decoding and disk writes never block
+    the event loop that drives the browser. The queue is bounded, so a slow
+    disk applies backpressure instead of buffering every body in memory.
+    """
+
+    def __init__(self, workers=4, queue_size=256):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self._executor = None
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="writer")
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+        return self
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            func, args = await self._queue.get()
+            try:
+                await loop.run_in_executor(self._executor, func, *args)
+            except Exception as e:
+                print(f"⚠️ Error saving file: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def submit(self, func, *args):
+        """Queue ``func(*args)`` to run in the writer pool"""
+        if self._queue is None:
+            # Late responses after close() are saved inline
+            func(*args)
+            return
+        await self._queue.put((func, args))
+
+    async def drain(self):
+        """Wait until every job queued so far has finished"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        """Wait for all queued jobs to finish and stop the pool"""
+        if self._queue is None:
+            return
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self._queue = None